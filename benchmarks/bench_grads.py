@@ -0,0 +1,75 @@
+# Copyright (c) 2020 Uber Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Gradient assembly time of compute_grads, per ES step, with the old batched
+weighted sum and with the blocked gather + gemv kernel.
+
+    python -m benchmarks.bench_grads --perturbations 512
+'''
+
+from argparse import ArgumentParser
+import time
+import numpy as np
+import poet_distributed.es as es
+from poet_distributed.noise import SharedNoiseTable
+from poet_distributed.stats import batched_weighted_sum
+from poet_distributed.niches.box2d.model import Model
+from poet_distributed.niches.box2d.env import bipedhard_custom
+
+
+def time_per_call(fn, repeats):
+    fn()
+    t_start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - t_start) / repeats
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--perturbations', type=int, default=512)
+    parser.add_argument('--noise_count', type=int, default=25000000)
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    dim = len(Model(bipedhard_custom).get_random_model_params())
+    es.noise = noise = SharedNoiseTable(count=args.noise_count)
+
+    rs = np.random.RandomState(args.seed)
+    noise_inds = np.asarray([noise.sample_index(rs, dim)
+                             for _ in range(args.perturbations)])
+    weights = rs.randn(args.perturbations).astype(np.float32)
+
+    def batched():
+        return batched_weighted_sum(
+            weights, (noise.get(idx, dim) for idx in noise_inds), batch_size=500)[0]
+
+    def gathered():
+        return es.noise_weighted_sum(weights, noise_inds, dim)
+
+    batched_time = time_per_call(batched, args.repeats)
+    gathered_time = time_per_call(gathered, args.repeats)
+    max_error = np.abs(batched() - gathered()).max()
+
+    print('{} perturbations x {} parameters'.format(args.perturbations, dim))
+    print('batched_weighted_sum: {:.3f} ms/step'.format(batched_time * 1e3))
+    print('noise_weighted_sum:   {:.3f} ms/step'.format(gathered_time * 1e3))
+    print('speedup {:.2f}x, max abs gradient difference {:.2e}'.format(
+        batched_time / gathered_time, max_error))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# Copyright (c) 2020 Uber Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Per-step latency of Model.get_action, with and without fast inference.
+
+    python -m benchmarks.bench_policy --steps 100000
+'''
+
+from argparse import ArgumentParser
+import time
+import numpy as np
+from poet_distributed.niches.box2d.model import Model
+from poet_distributed.niches.box2d.env import bipedhard_custom
+
+
+def time_get_action(model, observations):
+    t_start = time.perf_counter()
+    for obs in observations:
+        model.get_action(obs)
+    return (time.perf_counter() - t_start) / len(observations)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--steps', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+    observations = np.random.randn(args.steps, bipedhard_custom.input_size)
+
+    model = Model(bipedhard_custom)
+    theta = model.get_random_model_params()
+    model.set_model_params(theta)
+    default_latency = time_get_action(model, observations)
+
+    fast_model = Model(bipedhard_custom, fast_inference=True)
+    fast_model.set_model_params(theta)
+    fast_latency = time_get_action(fast_model, observations)
+
+    max_error = max(np.abs(model.get_action(obs) - fast_model.get_action(obs)).max()
+                    for obs in observations[:1000])
+
+    print('get_action default: {:.2f} us/step'.format(default_latency * 1e6))
+    print('get_action fast:    {:.2f} us/step'.format(fast_latency * 1e6))
+    print('speedup {:.2f}x, max abs action difference {:.2e}'.format(
+        default_latency / fast_latency, max_error))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+# Copyright (c) 2020 Uber Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Benchmark suite that runs on one machine, without Fiber: rollout throughput,
+policy latency, gradient assembly, return ranking and a full ind_es_step on
+a local executor. Results are written as JSON, to compare runs over time.
+
+    python -m benchmarks.suite --out bench.json
+    python -m benchmarks.suite --only rollout policy
+'''
+
+from argparse import ArgumentParser
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import master
+import poet_distributed.es as es
+import poet_distributed.noise_module as noise_module
+from poet_distributed.noise import SharedNoiseTable
+from poet_distributed.poet_algo import MultiESOptimizer
+from poet_distributed.executors import EXECUTORS
+from poet_distributed.stats import batched_weighted_sum, compute_centered_ranks
+from poet_distributed.niches import Box2DNiche
+from poet_distributed.niches.box2d.cppn import CppnEnvParams
+from poet_distributed.niches.box2d.env import Env_config, bipedhard_custom
+from poet_distributed.niches.box2d.model import Model
+from benchmarks.bench_grads import time_per_call
+from benchmarks.bench_policy import time_get_action
+
+ENVS = {
+    'flat': Env_config(
+        name='flat', ground_roughness=0, pit_gap=[], stump_width=[], stump_height=[],
+        stump_float=[], stair_height=[], stair_width=[], stair_steps=[]),
+    'hardcore': Env_config(
+        name='hardcore', ground_roughness=5, pit_gap=[2.0, 4.0], stump_width=[1.0, 2.0],
+        stump_height=[1.0, 2.0], stump_float=[], stair_height=[], stair_width=[], stair_steps=[]),
+}
+
+
+def bench_rollout(args):
+    '''episodes and timesteps per second of Box2DNiche.rollout, per env'''
+    results = {}
+    for name, env in ENVS.items():
+        random.seed(args.seed)
+        niche = Box2DNiche(env, CppnEnvParams(), seed=args.seed,
+                           stochastic=args.stochastic, fast_policy=args.fast_policy)
+        rs = np.random.RandomState(args.seed)
+        theta = niche.initial_theta()
+        niche.rollout(theta, rs)
+
+        timesteps = 0
+        t_start = time.perf_counter()
+        for _ in range(args.episodes):
+            _, length = niche.rollout(theta, rs)
+            timesteps += length
+        elapsed = time.perf_counter() - t_start
+        results[name] = {
+            'episodes': args.episodes,
+            'episodes_per_second': args.episodes / elapsed,
+            'timesteps_per_second': timesteps / elapsed,
+        }
+    return results
+
+
+def bench_policy(args):
+    '''per-step latency of Model.get_action'''
+    rs = np.random.RandomState(args.seed)
+    observations = rs.randn(args.policy_steps, bipedhard_custom.input_size)
+    theta = Model(bipedhard_custom).get_random_model_params()
+    results = {}
+    for name, fast_inference in (('default', False), ('fast', True)):
+        model = Model(bipedhard_custom, fast_inference=fast_inference)
+        model.set_model_params(theta)
+        results[name] = {'us_per_step': time_get_action(model, observations) * 1e6}
+    return results
+
+
+def bench_grads(args):
+    '''gradient assembly time versus population size and parameter count'''
+    noise = es.noise = SharedNoiseTable(count=args.noise_count)
+    rs = np.random.RandomState(args.seed)
+    results = []
+    for dim in args.dims:
+        for population in args.populations:
+            noise_inds = np.asarray([noise.sample_index(rs, dim) for _ in range(population)])
+            weights = rs.randn(population).astype(np.float32)
+            results.append({
+                'population': population,
+                'dim': dim,
+                'batched_weighted_sum_ms': 1e3 * time_per_call(
+                    lambda: batched_weighted_sum(
+                        weights, (noise.get(idx, dim) for idx in noise_inds), batch_size=500),
+                    args.repeats),
+                'noise_weighted_sum_ms': 1e3 * time_per_call(
+                    lambda: es.noise_weighted_sum(weights, noise_inds, dim), args.repeats),
+            })
+    return results
+
+
+def bench_ranks(args):
+    '''compute_centered_ranks over the (population, 2) returns of a step'''
+    rs = np.random.RandomState(args.seed)
+    results = []
+    for population in args.populations:
+        returns = rs.randn(population, 2)
+        results.append({
+            'population': population,
+            'ms': 1e3 * time_per_call(lambda: compute_centered_ranks(returns), args.repeats),
+        })
+    return results
+
+
+def bench_es_step(args):
+    '''wall time of one ind_es_step over several niches'''
+    log_dir = tempfile.mkdtemp(prefix='poet_bench_')
+    poet_args = master.parse_args([
+        os.path.join(log_dir, 'bench'),
+        '--num_workers', str(args.num_workers),
+        '--batches_per_chunk', str(args.batches_per_chunk),
+        '--batch_size', str(args.batch_size),
+        '--eval_batches_per_step', str(args.eval_batches_per_step),
+        '--master_seed', str(args.seed),
+        '--envs', 'roughness',
+        '--executor', args.executor,
+    ] + (['--stochastic'] if args.stochastic else []) +
+        (['--fast_policy'] if args.fast_policy else []))
+    os.makedirs(poet_args.log_file)
+
+    # built before the pool, so forked workers share it
+    noise_module.noise = SharedNoiseTable(count=args.noise_count)
+    es.initialize_master_fiber()
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+
+    poet = MultiESOptimizer(poet_args)
+    try:
+        for i in range(1, args.niches):
+            env = ENVS['flat']._replace(name='r{}'.format(i), ground_roughness=i)
+            poet.add_optimizer(env=env, cppn_params=CppnEnvParams(), seed=args.seed + i)
+
+        # the first step also fills the workers' niche and theta caches
+        poet.ind_es_step(iteration=0)
+        t_start = time.perf_counter()
+        for iteration in range(1, args.es_steps + 1):
+            poet.ind_es_step(iteration=iteration)
+        elapsed = (time.perf_counter() - t_start) / args.es_steps
+    finally:
+        poet.fiber_pool.terminate()
+        shutil.rmtree(log_dir, ignore_errors=True)
+
+    # evals of deterministic niches are cached, so only count the perturbations
+    po_episodes = args.niches * 2 * args.batches_per_chunk * args.batch_size
+    return {
+        'niches': args.niches,
+        'executor': args.executor,
+        'num_workers': args.num_workers,
+        'seconds_per_step': elapsed,
+        'po_episodes_per_second': po_episodes / elapsed,
+    }
+
+
+BENCHMARKS = {
+    'rollout': bench_rollout,
+    'policy': bench_policy,
+    'grads': bench_grads,
+    'ranks': bench_ranks,
+    'es_step': bench_es_step,
+}
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument('--out', default=None)  # json file to write, stdout otherwise
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--stochastic', action='store_true', default=False)
+    parser.add_argument('--fast_policy', action='store_true', default=False)
+    parser.add_argument('--episodes', type=int, default=5)
+    parser.add_argument('--policy_steps', type=int, default=20000)
+    parser.add_argument('--noise_count', type=int, default=25000000)
+    parser.add_argument('--populations', type=int, nargs='+', default=[256, 1024, 4096])
+    parser.add_argument('--dims', type=int, nargs='+', default=[
+        len(Model(bipedhard_custom).get_random_model_params()), 20000])
+    parser.add_argument('--niches', type=int, default=4)
+    parser.add_argument('--num_workers', type=int, default=os.cpu_count())
+    parser.add_argument('--executor', default='fork', choices=EXECUTORS)
+    parser.add_argument('--batches_per_chunk', type=int, default=8)
+    parser.add_argument('--batch_size', type=int, default=4)
+    parser.add_argument('--eval_batches_per_step', type=int, default=4)
+    parser.add_argument('--es_steps', type=int, default=2)
+    args = parser.parse_args()
+    # master sets up INFO logging; keep the optimizers quiet
+    logging.getLogger().setLevel(logging.WARNING)
+
+    report = {'environment': environment(), 'args': vars(args), 'results': {}}
+    for name in args.only:
+        t_start = time.perf_counter()
+        report['results'][name] = BENCHMARKS[name](args)
+        print('{} done in {:.1f}s'.format(name, time.perf_counter() - t_start),
+              file=sys.stderr)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -19,25 +19,32 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 import numpy as np
 from poet_distributed.es import initialize_master_fiber
+from poet_distributed.noise_module import noise_config_from_args
+from poet_distributed.executors import EXECUTORS
 from poet_distributed.poet_algo import MultiESOptimizer
 
 
 def run_main(args):
 
-    initialize_master_fiber()
+    initialize_master_fiber(noise_config_from_args(args), args.profile)
 
     #set master_seed
     np.random.seed(args.master_seed)
 
     optimizer_zoo = MultiESOptimizer(args=args)
 
+    start_iteration = 0
+    if args.resume:
+        start_iteration = optimizer_zoo.resume(args.resume)
+
     optimizer_zoo.optimize(iterations=args.n_iterations,
                        propose_with_adam=args.propose_with_adam,
                        reset_optimizer=True,
                        checkpointing=args.checkpointing,
-                       steps_before_transfer=args.steps_before_transfer)
+                       steps_before_transfer=args.steps_before_transfer,
+                       start_iteration=start_iteration)
 
-def main():
+def parse_args(argv=None):
     parser = ArgumentParser()
     parser.add_argument('log_file')
     parser.add_argument('--init', default='random')
@@ -53,6 +60,8 @@ def main():
     parser.add_argument('--eval_batch_size', type=int, default=1)
     parser.add_argument('--eval_batches_per_step', type=int, default=50)
     parser.add_argument('--num_workers', type=int, default=20)
+    parser.add_argument('--executor', default='fiber', choices=EXECUTORS)  # fork, process_pool or serial run on this machine only, without Fiber
+    parser.add_argument('--tasks_per_worker', type=int, default=0)  # coalesce each chunk into num_workers * k tasks; 0 sends one task per batch
     parser.add_argument('--n_iterations', type=int, default=200)
     parser.add_argument('--steps_before_transfer', type=int, default=25)
     parser.add_argument('--master_seed', type=int, default=111)
@@ -66,10 +75,24 @@ def main():
     parser.add_argument('--adjust_interval', type=int, default=4)
     parser.add_argument('--returns_normalization', default='normal')
     parser.add_argument('--stochastic', action='store_true', default=False)
+    parser.add_argument('--fast_policy', action='store_true', default=False)  # float32 in-place policy forward pass
+    parser.add_argument('--grad_reduction', default='master', choices=['master', 'workers'])  # where the noise-weighted gradient sum is computed; workers sum it in num_workers partials
     parser.add_argument('--envs', nargs='+')
-    parser.add_argument('--start_from', default=None)  # Json file to start from
+    parser.add_argument('--noise_backend', default='shared', choices=['shared', 'memmap'])
+    parser.add_argument('--noise_generator', default='randn', choices=['randn', 'pcg64'])
+    parser.add_argument('--noise_threads', type=int, default=1)  # threads sampling a pcg64 table
+    parser.add_argument('--noise_dir', default=None)  # where the memmap noise table is built
+    parser.add_argument('--broadcast_dir', default=None)  # each run publishes thetas and niches to workers in a directory of its own under this; must be shared with remote workers
+    parser.add_argument('--profile', action='store_true', default=False)  # time worker and master phases, written per iteration to log_file/<name>.profile.log
+    parser.add_argument('--log_columns', action='store_true', default=False)  # also write per-niche logs as npz column chunks, see logger.load_columns
+    parser.add_argument('--checkpoint_interval', type=int, default=0)  # iterations between checkpoints of the whole run into log_file/checkpoint; 0 disables
+    parser.add_argument('--resume', '--start_from', default=None)  # checkpoint directory to continue a run from
+
+    return parser.parse_args(argv)
 
-    args = parser.parse_args()
+
+def main():
+    args = parse_args()
     logger.info(args)
 
     run_main(args)
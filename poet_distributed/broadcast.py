@@ -0,0 +1,133 @@
+# Copyright (c) 2020 Uber Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import atexit
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+from collections import OrderedDict
+import numpy as np
+import logging
+logger = logging.getLogger(__name__)
+
+
+def theta_key(theta):
+    '''digest of a theta's contents, used as its version'''
+    theta = np.ascontiguousarray(theta)
+    h = hashlib.sha1(theta.view(np.uint8))
+    h.update(str((theta.dtype.str, theta.shape)).encode())
+    return h.hexdigest()
+
+
+class BoundedCache:
+    ''' least recently used cache holding at most maxsize items '''
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+
+    def get(self, key, load):
+        if key in self.items:
+            self.items.move_to_end(key)
+            return self.items[key]
+        value = load(key)
+        self.items[key] = value
+        if len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+        return value
+
+    def clear(self):
+        self.items.clear()
+
+
+class ParameterStore:
+    '''
+        File-backed store that the master publishes thetas and niches to and
+        workers read from. Thetas are keyed by a digest of their contents, so
+        re-sending an unchanged theta costs nothing; niches are written once
+        per version. Each run gets a directory of its own, removed at exit,
+        in /dev/shm by default so on a single host this is shared memory;
+        for workers on other hosts give a root on a shared volume.
+    '''
+    def __init__(self, root=None):
+        if root is None and os.path.isdir('/dev/shm'):
+            root = '/dev/shm'
+        elif root is not None:
+            os.makedirs(root, exist_ok=True)
+        root = tempfile.mkdtemp(prefix='poet_broadcast_', dir=root)
+        atexit.register(shutil.rmtree, root, True)
+        self.root = root
+        os.makedirs(os.path.join(root, 'thetas'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'niches'), exist_ok=True)
+        logger.info('Broadcasting parameters through {}'.format(root))
+
+        # master-side bookkeeping, not shipped to workers
+        self.published_thetas = set()
+        self.niche_versions = {}
+
+    def __getstate__(self):
+        return {'root': self.root}
+
+    def __setstate__(self, state):
+        self.root = state['root']
+        self.published_thetas = set()
+        self.niche_versions = {}
+
+    def _write(self, path, write):
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            write(f)
+        os.rename(tmp_path, path)
+
+    def theta_path(self, key):
+        return os.path.join(self.root, 'thetas', key + '.npy')
+
+    def niche_path(self, key):
+        return os.path.join(self.root, 'niches', key + '.pickle')
+
+    def publish_theta(self, theta):
+        key = theta_key(theta)
+        if key not in self.published_thetas:
+            self._write(self.theta_path(key), lambda f: np.save(f, theta))
+            self.published_thetas.add(key)
+        return key
+
+    def get_theta(self, key):
+        return np.load(self.theta_path(key))
+
+    def keep_thetas(self, thetas):
+        '''drop every published theta but `thetas`; only call with no tasks in flight'''
+        keep = set(theta_key(theta) for theta in thetas)
+        for key in self.published_thetas - keep:
+            os.remove(self.theta_path(key))
+        self.published_thetas &= keep
+
+    def publish_niche(self, optim_id, niche, version=None):
+        if version is None:
+            version = self.niche_versions.get(optim_id, -1) + 1
+        self.niche_versions[optim_id] = max(version, self.niche_versions.get(optim_id, -1))
+        key = '{}.{}'.format(optim_id, version)
+        self._write(self.niche_path(key),
+                    lambda f: pickle.dump(niche, f, protocol=pickle.HIGHEST_PROTOCOL))
+        return key
+
+    def get_niche(self, key):
+        with open(self.niche_path(key), 'rb') as f:
+            return pickle.load(f)
+
+    def remove_niche(self, key):
+        '''drop a published niche; only call with no tasks using it in flight'''
+        os.remove(self.niche_path(key))
@@ -0,0 +1,137 @@
+# Copyright (c) 2020 Uber Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import pickle
+import random
+import struct
+import time
+import numpy as np
+import logging
+logger = logging.getLogger(__name__)
+
+# Protocol 5 pickles numpy arrays out of band, so thetas and Adam moments are
+# written and read as raw buffers instead of being copied through the pickle.
+CHECKPOINT_PROTOCOL = min(5, pickle.HIGHEST_PROTOCOL)
+CHECKPOINT_MAGIC = b'POETCKPT'
+
+
+def dump(obj, path):
+    '''write obj to path atomically'''
+    buffers = []
+    if CHECKPOINT_PROTOCOL >= 5:
+        data = pickle.dumps(obj, protocol=CHECKPOINT_PROTOCOL,
+                            buffer_callback=buffers.append)
+    else:
+        data = pickle.dumps(obj, protocol=CHECKPOINT_PROTOCOL)
+    raws = [buf.raw() for buf in buffers]
+    sizes = [len(data)] + [raw.nbytes for raw in raws]
+
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(CHECKPOINT_MAGIC)
+        f.write(struct.pack('<Q', len(sizes)))
+        f.write(struct.pack('<{}Q'.format(len(sizes)), *sizes))
+        f.write(data)
+        for raw in raws:
+            f.write(raw)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load(path):
+    with open(path, 'rb') as f:
+        # read into a bytearray so that the arrays loaded over it are writable
+        blob = bytearray(os.fstat(f.fileno()).st_size)
+        f.readinto(blob)
+    view = memoryview(blob)
+    if view[:len(CHECKPOINT_MAGIC)] != CHECKPOINT_MAGIC:
+        raise ValueError('{} is not a POET checkpoint'.format(path))
+    offset = len(CHECKPOINT_MAGIC)
+    count, = struct.unpack_from('<Q', view, offset)
+    offset += 8
+    sizes = struct.unpack_from('<{}Q'.format(count), view, offset)
+    offset += 8 * count
+
+    chunks = []
+    for size in sizes:
+        chunks.append(view[offset:offset + size])
+        offset += size
+    if len(chunks) == 1:
+        # written below protocol 5; pickle.loads takes no buffers before 3.8
+        return pickle.loads(chunks[0])
+    return pickle.loads(chunks[0], buffers=chunks[1:])
+
+
+def save_checkpoint(poet, iteration, path):
+    '''
+        write the state of a MultiESOptimizer, to resume at `iteration`.
+        Archived optimizers are written once, when first seen; their PATA-EC
+        vectors, the only part that still changes, go with the main state.
+        The loggers are flushed first and record how far their files got,
+        resuming cuts off the rows logged after the checkpoint.
+    '''
+    t_start = time.time()
+    archive_dir = os.path.join(path, 'archive')
+    os.makedirs(archive_dir, exist_ok=True)
+
+    for o in poet.optimizers.values():
+        o.data_logger.flush()
+    if poet.profile_logger is not None:
+        poet.profile_logger.flush()
+
+    for optim_id, o in poet.archived_optimizers.items():
+        archive_path = os.path.join(archive_dir, optim_id + '.pkl')
+        if not os.path.exists(archive_path):
+            dump(o, archive_path)
+
+    dump({
+        'iteration': iteration,
+        'ANNECS': poet.ANNECS,
+        'env_registry': poet.env_registry,
+        'env_archive': poet.env_archive,
+        'env_reproducer': poet.env_reproducer,
+        'optimizers': poet.optimizers,
+        'score_matrix': poet.score_matrix,
+        'profile_logger': poet.profile_logger,
+        'archived_pata_ec': [(optim_id, o.pata_ec)
+                             for optim_id, o in poet.archived_optimizers.items()],
+        'np_random_state': np.random.get_state(),
+        'random_state': random.getstate(),
+    }, os.path.join(path, 'state.pkl'))
+
+    logger.info('Checkpointed iteration {} to {} in {:.2f}s'.format(
+        iteration, path, time.time() - t_start))
+
+
+def load_checkpoint(path):
+    '''
+        the state written by save_checkpoint, with the archived optimizers
+        read back in; optimizers still need to be attached to a pool
+    '''
+    t_start = time.time()
+    state = load(os.path.join(path, 'state.pkl'))
+
+    archived_optimizers = []
+    for optim_id, pata_ec in state.pop('archived_pata_ec'):
+        o = load(os.path.join(path, 'archive', optim_id + '.pkl'))
+        o.pata_ec = pata_ec
+        archived_optimizers.append((optim_id, o))
+    state['archived_optimizers'] = archived_optimizers
+
+    logger.info('Loaded iteration {} from {} in {:.2f}s'.format(
+        state['iteration'], path, time.time() - t_start))
+    return state
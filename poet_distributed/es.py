@@ -17,10 +17,15 @@ import logging
 import time
 import numpy as np
 from collections import namedtuple
-from .stats import compute_centered_ranks, batched_weighted_sum
+from .stats import compute_centered_ranks
 from .logger import CSVLogger
-import json
-import functools
+from .policy import write_policy
+from .broadcast import BoundedCache
+from .score_matrix import ScoreMatrix
+from . import profiling
+
+# Evals of deterministic niches kept on the master, by (theta, niche version)
+EVAL_CACHE_SIZE = 4096
 
 StepStats = namedtuple('StepStats', [
     'po_returns_mean',
@@ -51,72 +56,154 @@ EvalStats = namedtuple('StepStats', [
     'time_elapsed',
 ])
 
+# times: the worker's profiling.WORKER_PHASES seconds, None unless profiling
 POResult = namedtuple('POResult', [
     'noise_inds',
     'returns',
     'lengths',
+    'times',
 ])
-EvalResult = namedtuple('EvalResult', ['returns', 'lengths'])
+EvalResult = namedtuple('EvalResult', ['returns', 'lengths', 'times'])
+GradsResult = namedtuple('GradsResult', ['grads', 'times'])
+# namedtuple(defaults=) needs Python 3.7
+POResult.__new__.__defaults__ = (None,)
+EvalResult.__new__.__defaults__ = (None,)
+GradsResult.__new__.__defaults__ = (None,)
 
 logger = logging.getLogger(__name__)
 
 
-def initialize_master_fiber():
+def initialize_master_fiber(noise_config=None, profile=False):
     global noise
-    from .noise_module import noise
-
-def initialize_worker_fiber(arg_thetas, arg_niches):
-    global noise, thetas, niches
-    from .noise_module import noise
-    thetas = arg_thetas
-    niches = arg_niches
-
-@functools.lru_cache(maxsize=1000)
-def fiber_get_theta(iteration, optim_id):
-    return thetas[optim_id]
-
-@functools.lru_cache(maxsize=1000)
-def fiber_get_niche(iteration, optim_id):
-    return niches[optim_id]
-
-def run_eval_batch_fiber(iteration, optim_id, batch_size, rs_seed):
+    from .noise_module import get_noise
+    noise = get_noise(noise_config)
+    profiling.enabled = profile
+
+def initialize_worker_fiber(arg_store, noise_config=None, profile=False):
+    global noise, store, thetas, niches
+    from .noise_module import get_noise
+    profiling.enabled = profile
+    noise = get_noise(noise_config)
+    store = arg_store
+    thetas = BoundedCache(maxsize=64)
+    niches = BoundedCache(maxsize=64)
+
+def fiber_get_theta(theta_key):
+    return thetas.get(theta_key, store.get_theta)
+
+def fiber_get_niche(niche_ref):
+    if isinstance(niche_ref, str):
+        return niches.get(niche_ref, store.get_niche)
+    # candidate niches are shipped with the task
+    return niche_ref
+
+def run_eval_batch_fiber(theta_key, niche_ref, batch_size, rs_seed):
     global noise, niches, thetas
     random_state = np.random.RandomState(rs_seed)
-    niche = fiber_get_niche(iteration, optim_id)
-    theta = fiber_get_theta(iteration, optim_id)
+    niche = fiber_get_niche(niche_ref)
+    theta = fiber_get_theta(theta_key)
 
     returns, lengths = niche.rollout_batch((theta for i in range(batch_size)),
                                            batch_size, random_state, eval=True)
 
-    return EvalResult(returns=returns, lengths=lengths)
+    return EvalResult(returns=returns, lengths=lengths, times=profiling.pop_task_times())
 
-def run_po_batch_fiber(iteration, optim_id, batch_size, rs_seed, noise_std):
+def run_po_batch_fiber(theta_key, niche_ref, batch_size, rs_seed, noise_std):
     global noise, niches, thetas
     random_state = np.random.RandomState(rs_seed)
-    niche = fiber_get_niche(iteration, optim_id)
-    theta = fiber_get_theta(iteration, optim_id)
-    noise_inds = np.asarray([noise.sample_index(random_state, len(theta))
-                             for i in range(batch_size)],
-                            dtype='int')
+    niche = fiber_get_niche(niche_ref)
+    theta = fiber_get_theta(theta_key)
+    with profiling.task_times.phase('noise'):
+        noise_inds = np.asarray([noise.sample_index(random_state, len(theta))
+                                 for i in range(batch_size)],
+                                dtype='int')
 
     returns = np.zeros((batch_size, 2))
     lengths = np.zeros((batch_size, 2), dtype='int')
 
-    returns[:, 0], lengths[:, 0] = niche.rollout_batch(
-        (theta + noise_std * noise.get(noise_idx, len(theta))
-         for noise_idx in noise_inds), batch_size, random_state)
-
-    returns[:, 1], lengths[:, 1] = niche.rollout_batch(
-        (theta - noise_std * noise.get(noise_idx, len(theta))
-         for noise_idx in noise_inds), batch_size, random_state)
-
-    return POResult(returns=returns, noise_inds=noise_inds, lengths=lengths)
+    returns[:, 0], lengths[:, 0] = niche.rollout_perturbed_batch(
+        theta, (noise.get(noise_idx, len(theta)) for noise_idx in noise_inds),
+        noise_std, batch_size, random_state)
+
+    returns[:, 1], lengths[:, 1] = niche.rollout_perturbed_batch(
+        theta, (noise.get(noise_idx, len(theta)) for noise_idx in noise_inds),
+        -noise_std, batch_size, random_state)
+
+    return POResult(returns=returns, noise_inds=noise_inds, lengths=lengths,
+                    times=profiling.pop_task_times())
+
+# Noise rows gathered per gemv. A block this size stays in cache, a single
+# gemv over a whole population of a few thousand rows does not.
+GRADS_BLOCK_ROWS = 64
+
+def noise_weighted_sum(weights, noise_inds, dim, block_rows=GRADS_BLOCK_ROWS):
+    '''sum of the noise slices at noise_inds scaled by weights, in float32'''
+    weights = np.asarray(weights, dtype=np.float32)
+    total = np.zeros(dim, dtype=np.float32)
+    for start in range(0, len(noise_inds), block_rows):
+        end = start + block_rows
+        total += np.dot(weights[start:end], noise.gather(noise_inds[start:end], dim))
+    return total
+
+class CachedEval:
+    '''
+        Eval of a deterministic niche: one episode, run once per theta and
+        niche version, whose (return, length) is then kept on the master for
+        the next evals of the pair. Without a task it is answered from the
+        cache and ran no episode. Shares the ready/wait/get interface of the
+        pool's results.
+    '''
+    def __init__(self, cache, key, task=None):
+        self.cache = cache
+        self.key = key
+        self.task = task
+        self.cached = task is None
+        if self.cached:
+            self.value = cache.get(key, None)
+
+    def ready(self):
+        return self.cached or self.task.ready()
+
+    def wait(self, timeout=None):
+        if not self.cached:
+            self.task.wait(timeout)
+
+    def get(self):
+        if self.cached:
+            eval_return, eval_length = self.value
+            return EvalResult(returns=np.array([eval_return]),
+                              lengths=np.array([eval_length]))
+        result = self.task.get()
+        self.cache.get(self.key, lambda key: (result.returns[0], result.lengths[0]))
+        return result
+
+def wait_for_any(pending, timeout=0.01):
+    '''block until a task of one of the pending steps or evals finishes, or timeout'''
+    with profiling.master_times.phase('wait'):
+        for res in pending:
+            for task in res[0]:
+                if not task.ready():
+                    task.wait(timeout)
+                    return
+
+def run_grads_fiber(noise_inds, weights, dim):
+    '''partial gradient over a slice of a step's perturbations'''
+    with profiling.task_times.phase('noise'):
+        grads = noise_weighted_sum(weights, noise_inds, dim)
+    return GradsResult(grads=grads, times=profiling.pop_task_times())
+
+def run_coalesced_fiber(runner, theta_key, niche_ref, batch_size, rs_seeds, *args):
+    '''run `runner` once per seed and merge the results into one'''
+    results = [runner(theta_key, niche_ref, batch_size, rs_seed, *args)
+               for rs_seed in rs_seeds]
+    fields = [np.concatenate(field) for field in zip(*(r[:-1] for r in results))]
+    return type(results[0])(*fields, times=profiling.merge_times(r.times for r in results))
 
 
 class ESOptimizer:
     def __init__(self,
                  fiber_pool,
-                 fiber_shared,
+                 store,
                  theta,
                  make_niche,
                  learning_rate,
@@ -134,14 +221,20 @@ class ESOptimizer:
                  returns_normalization='centered_ranks',
                  optim_id=0,
                  log_file='unname.log',
+                 log_columns=False,
                  created_at=0,
-                 is_candidate=False):
+                 is_candidate=False,
+                 num_chunk_tasks=0,
+                 score_matrix=None,
+                 grad_reduction='master',
+                 num_grad_tasks=1,
+                 eval_cache=None):
 
         from .optimizers import Adam, SimpleSGD
 
         logger.debug('Creating optimizer {}...'.format(optim_id))
         self.fiber_pool = fiber_pool
-        self.fiber_shared = fiber_shared
+        self.store = store
 
         self.optim_id = optim_id
         assert self.fiber_pool is not None
@@ -157,9 +250,17 @@ class ESOptimizer:
         self.noise_decay = noise_decay
         self.noise_limit = noise_limit
 
-        self.fiber_shared = fiber_shared
-        niches = fiber_shared["niches"]
-        niches[optim_id] = make_niche()
+        niche = make_niche()
+        if is_candidate:
+            # throwaway candidates are not published, their tasks carry the
+            # niche itself; the key only names it in the caches
+            self.niche_key = '{}.candidate'.format(optim_id)
+            self.niche_ref = niche
+        else:
+            self.niche_key = self.niche_ref = store.publish_niche(optim_id, niche)
+        self.deterministic_eval = niche.deterministic_eval()
+        self.eval_cache = eval_cache if eval_cache is not None else BoundedCache(EVAL_CACHE_SIZE)
+        self.score_matrix = score_matrix if score_matrix is not None else ScoreMatrix()
 
         self.batches_per_chunk = batches_per_chunk
         self.batch_size = batch_size
@@ -171,6 +272,9 @@ class ESOptimizer:
 
         self.normalize_grads_by_noise_std = normalize_grads_by_noise_std
         self.returns_normalization = returns_normalization
+        self.num_chunk_tasks = num_chunk_tasks
+        self.grad_reduction = grad_reduction
+        self.num_grad_tasks = num_grad_tasks
 
         if is_candidate == False:
             log_fields = [
@@ -208,10 +312,10 @@ class ESOptimizer:
             self.data_logger = CSVLogger(log_path, log_fields + [
                 'time_elapsed_so_far',
                 'iteration',
-            ])
+            ], columns=log_columns)
             logger.info('Optimizer {} created!'.format(optim_id))
 
-        self.filename_best = log_file + '/' + log_file.split('/')[-1] + '.' + optim_id + '.best.json'
+        self.filename_best = log_file + '/' + log_file.split('/')[-1] + '.' + optim_id + '.best.npy'
         self.log_data = {}
         self.t_start = time.time()
         self.episodes_so_far = 0
@@ -230,16 +334,61 @@ class ESOptimizer:
 
         self.best_score = None
         self.best_theta = None
+        self.saved_best_score = None
         self.recent_scores = []
         self.transfer_target = None
         self.pata_ec = None
 
-        self.iteration = 0
-
     def __del__(self):
         logger.debug('Optimizer {} cleanning up workers...'.format(
             self.optim_id))
 
+    def __getstate__(self):
+        '''everything but the handles to the pool and shared caches, for checkpoints'''
+        state = self.__dict__.copy()
+        for name in ('fiber_pool', 'store', 'score_matrix', 'eval_cache', 'niche_ref'):
+            del state[name]
+        state['niche'] = self.get_niche()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def attach(self, fiber_pool, store, score_matrix, eval_cache, publish=True):
+        '''
+            hook an optimizer restored from a checkpoint up to the pool and
+            caches; publish=False keeps its niche on the master, as archived
+            optimizers do
+        '''
+        self.fiber_pool = fiber_pool
+        self.store = store
+        self.score_matrix = score_matrix
+        self.eval_cache = eval_cache
+        niche = self.__dict__.pop('niche')
+        if not publish:
+            self.niche_ref = niche
+            return
+        # keep the niche's key, the restored score matrix refers to it
+        version = int(self.niche_key.rsplit('.', 1)[1])
+        self.niche_key = self.niche_ref = store.publish_niche(
+            self.optim_id, niche, version=version)
+
+    def get_niche(self):
+        if isinstance(self.niche_ref, str):
+            return self.store.get_niche(self.niche_key)
+        return self.niche_ref
+
+    def unpublish_niche(self):
+        '''
+            keep the niche on the master and ship it with each task instead,
+            dropping its published copy; for archived optimizers, whose niche
+            is only evaluated now and then
+        '''
+        niche = self.get_niche()
+        if isinstance(self.niche_ref, str):
+            self.store.remove_niche(self.niche_key)
+        self.niche_ref = niche
+
     def clean_dicts_before_iter(self):
         self.log_data.clear()
         self.self_evals = None
@@ -280,15 +429,19 @@ class ESOptimizer:
         #if iteration % 100 == 0:
         #    self.save_policy(self.filename_best+'.arxiv.'+str(iteration))
 
-        self.save_policy(self.filename_best)
+        self.save_policy(self.filename_best, iteration)
 
-    def save_policy(self, policy_file, reset=False):
+    def save_policy(self, policy_file, iteration=None, reset=False):
         if self.best_score is not None and self.best_theta is not None:
-            with open(policy_file, 'wt') as out:
-                json.dump([self.best_theta.tolist(), self.best_score], out, sort_keys=True, indent=0, separators=(',', ': '))
+            # the best theta only changes along with its score
+            if self.best_score != self.saved_best_score:
+                write_policy(policy_file, self.best_theta, self.best_score,
+                             iteration, self.optim_id)
+                self.saved_best_score = self.best_score
             if reset:
                 self.best_score = None
                 self.best_theta = None
+                self.saved_best_score = None
 
 
     def update_dicts_after_transfer(self, source_optim_id, source_optim_theta, stats, keyword):
@@ -385,47 +538,71 @@ class ESOptimizer:
 
 
     def broadcast_theta(self, theta):
-        '''On all worker, set thetas[this optimizer] to theta'''
+        '''Make theta available to all workers, return its version key'''
         logger.debug('Optimizer {} broadcasting theta...'.format(self.optim_id))
 
-        thetas = self.fiber_shared["thetas"]
-        thetas[self.optim_id] = theta
-        self.iteration += 1
+        with profiling.master_times.phase('submit'):
+            return self.store.publish_theta(theta)
 
 
     def add_env(self, env):
         '''On all worker, add env_name to niche'''
         logger.debug('Optimizer {} add env {}...'.format(self.optim_id, env.name))
 
-        thetas = self.fiber_shared["niches"]
-        niches[self.optim_id].add_env(env)
+        niche = self.store.get_niche(self.niche_key)
+        niche.add_env(env)
+        old_key = self.niche_key
+        self.niche_key = self.niche_ref = self.store.publish_niche(self.optim_id, niche)
+        self.store.remove_niche(old_key)
 
     def delete_env(self, env_name):
         '''On all worker, delete env from niche'''
         logger.debug('Optimizer {} delete env {}...'.format(self.optim_id, env_name))
 
-        niches = self.fiber_shared["niches"]
-        niches[optim_id].delete_env(env_name)
+        niche = self.store.get_niche(self.niche_key)
+        niche.delete_env(env_name)
+        old_key = self.niche_key
+        self.niche_key = self.niche_ref = self.store.publish_niche(self.optim_id, niche)
+        self.store.remove_niche(old_key)
+
+    def draw_rs_seeds(self, batches_per_chunk):
+        return np.random.randint(np.int32(2 ** 31 - 1), size=batches_per_chunk)
 
-    def start_chunk_fiber(self, runner, batches_per_chunk, batch_size, *args):
+    def start_chunk_fiber(self, runner, theta_key, batches_per_chunk, batch_size, *args,
+                          rs_seeds=None):
         logger.debug('Optimizer {} spawning {} batches of size {}'.format(
             self.optim_id, batches_per_chunk, batch_size))
 
-        rs_seeds = np.random.randint(np.int32(2 ** 31 - 1), size=batches_per_chunk)
+        if rs_seeds is None:
+            rs_seeds = self.draw_rs_seeds(batches_per_chunk)
 
         chunk_tasks = []
         pool = self.fiber_pool
-        niches = self.fiber_shared["niches"]
-        thetas = self.fiber_shared["thetas"]
 
-        for i in range(batches_per_chunk):
-            chunk_tasks.append(
-                pool.apply_async(runner, args=(self.iteration,
-                    self.optim_id, batch_size, rs_seeds[i])+args))
+        with profiling.master_times.phase('submit'):
+            if 0 < self.num_chunk_tasks < batches_per_chunk:
+                # pack several batches into each task to save IPC round trips
+                for task_seeds in np.array_split(rs_seeds, self.num_chunk_tasks):
+                    chunk_tasks.append(
+                        pool.apply_async(run_coalesced_fiber, args=(runner, theta_key,
+                            self.niche_ref, batch_size, task_seeds)+args))
+                return chunk_tasks
+
+            for i in range(batches_per_chunk):
+                chunk_tasks.append(
+                    pool.apply_async(runner, args=(theta_key,
+                        self.niche_ref, batch_size, rs_seeds[i])+args))
         return chunk_tasks
 
     def get_chunk(self, tasks):
-        return [task.get() for task in tasks]
+        with profiling.master_times.phase('wait'):
+            results = [task.get() for task in tasks]
+        profiling.add_worker_times(results)
+        return results
+
+    def chunk_ready(self, res):
+        '''whether all tasks of a started step or eval have finished'''
+        return all(task.ready() for task in res[0])
 
     def collect_po_results(self, po_results):
         noise_inds = np.concatenate([r.noise_inds for r in po_results])
@@ -438,7 +615,39 @@ class ESOptimizer:
         eval_lengths = np.concatenate([r.lengths for r in eval_results])
         return eval_returns, eval_lengths
 
-    def compute_grads(self, step_results, theta):
+    def compute_weights(self, returns):
+        '''weight of each perturbation in the gradient'''
+        if self.returns_normalization == 'centered_ranks':
+            proc_returns = compute_centered_ranks(returns)
+        elif self.returns_normalization == 'normal':
+            proc_returns = (returns - returns.mean()) / (returns.std() + 1e-5)
+        else:
+            raise NotImplementedError(
+                'Invalid return normalization `{}`'.format(
+                    self.returns_normalization))
+        return proc_returns[:, 0] - proc_returns[:, 1]
+
+    def start_grads(self, res):
+        '''
+            hand the weights of a finished step back to the pool, split into
+            num_grad_tasks tasks, to be reduced into partial gradients by the
+            workers; the master then only sums num_grad_tasks partials
+        '''
+        step_tasks, theta, step_t_start = res
+        step_results = self.get_chunk(step_tasks)
+        noise_inds, returns, _ = self.collect_po_results(step_results)
+        weights = self.compute_weights(returns)
+
+        num_tasks = min(self.num_grad_tasks, len(weights))
+        with profiling.master_times.phase('submit'):
+            grad_tasks = [
+                self.fiber_pool.apply_async(run_grads_fiber,
+                    args=(task_inds, task_weights, len(theta)))
+                for task_inds, task_weights in zip(np.array_split(noise_inds, num_tasks),
+                                                   np.array_split(weights, num_tasks))]
+        return grad_tasks, theta, step_t_start, step_results
+
+    def compute_grads(self, step_results, theta, partial_grads=None):
         noise_inds, returns, _ = self.collect_po_results(step_results)
 
         pos_row, neg_row = returns.argmax(axis=0)
@@ -451,18 +660,11 @@ class ESOptimizer:
 
         po_theta_max = theta + noise_sign * self.noise_std * noise.get(po_noise_ind_max, len(theta))
 
-        if self.returns_normalization == 'centered_ranks':
-            proc_returns = compute_centered_ranks(returns)
-        elif self.returns_normalization == 'normal':
-            proc_returns = (returns - returns.mean()) / (returns.std() + 1e-5)
+        if partial_grads is None:
+            grads = noise_weighted_sum(
+                self.compute_weights(returns), noise_inds, len(theta))
         else:
-            raise NotImplementedError(
-                'Invalid return normalization `{}`'.format(
-                    self.returns_normalization))
-        grads, _ = batched_weighted_sum(
-            proc_returns[:, 0] - proc_returns[:, 1],
-            (noise.get(idx, len(theta)) for idx in noise_inds),
-            batch_size=500)
+            grads = np.sum([r.grads for r in partial_grads], axis=0)
 
         grads /= len(returns)
         if self.normalize_grads_by_noise_std:
@@ -475,13 +677,29 @@ class ESOptimizer:
             self.optimizer.reset()
             self.noise_std = self.init_noise_std
 
-    def start_theta_eval(self, theta):
+    def start_theta_eval(self, theta, rs_seeds=None):
         '''eval theta in this optimizer's niche'''
         step_t_start = time.time()
-        self.broadcast_theta(theta)
+        theta_key = self.broadcast_theta(theta)
+
+        if self.deterministic_eval:
+            # every episode would come out the same: run one, once per theta
+            # and niche version, and let it stand for the whole chunk
+            if rs_seeds is None:
+                # keep drawing the seeds, so the tasks that follow get the
+                # same ones as without the cache
+                self.draw_rs_seeds(self.eval_batches_per_step)
+            cache_key = (theta_key, self.niche_key)
+            if cache_key in self.eval_cache.items:
+                return [CachedEval(self.eval_cache, cache_key)], theta, step_t_start
+            with profiling.master_times.phase('submit'):
+                task = self.fiber_pool.apply_async(
+                    run_eval_batch_fiber, args=(theta_key, self.niche_ref, 1, 0))
+            return [CachedEval(self.eval_cache, cache_key, task)], theta, step_t_start
 
         eval_tasks = self.start_chunk_fiber(
-            run_eval_batch_fiber, self.eval_batches_per_step, self.eval_batch_size)
+            run_eval_batch_fiber, theta_key, self.eval_batches_per_step, self.eval_batch_size,
+            rs_seeds=rs_seeds)
 
         return eval_tasks, theta, step_t_start
 
@@ -489,11 +707,14 @@ class ESOptimizer:
         eval_tasks, theta, step_t_start = res
         eval_results = self.get_chunk(eval_tasks)
         eval_returns, eval_lengths = self.collect_eval_results(eval_results)
+        # evals answered from the cache count no episodes
+        n_episodes = sum(len(r.returns) for task, r in zip(eval_tasks, eval_results)
+                         if not getattr(task, 'cached', False))
         step_t_end = time.time()
 
         logger.debug(
             'get_theta_eval {} finished running {} episodes, {} timesteps'.format(
-                self.optim_id, len(eval_returns), eval_lengths.sum()))
+                self.optim_id, n_episodes, eval_lengths.sum()))
 
         return EvalStats(
             eval_returns_mean=eval_returns.mean(),
@@ -501,30 +722,40 @@ class ESOptimizer:
             eval_returns_std=eval_returns.std(),
             eval_len_mean=eval_lengths.mean(),
             eval_len_std=eval_lengths.std(),
-            eval_n_episodes=len(eval_returns),
+            eval_n_episodes=n_episodes,
             time_elapsed=step_t_end - step_t_start,
         )
 
-    def start_step(self, theta=None):
+    def start_step(self, theta=None, rs_seeds=None):
         ''' based on theta (if none, this optimizer's theta)
             generate the P.O. cloud, and eval them in this optimizer's niche
         '''
         step_t_start = time.time()
         if theta is None:
             theta = self.theta
-        self.broadcast_theta(theta)
+        theta_key = self.broadcast_theta(theta)
 
         step_results = self.start_chunk_fiber(
             run_po_batch_fiber,
+            theta_key,
             self.batches_per_chunk,
             self.batch_size,
-            self.noise_std)
+            self.noise_std,
+            rs_seeds=rs_seeds)
 
         return step_results, theta, step_t_start
 
     def get_step(self, res, propose_with_adam=True, decay_noise=True, propose_only=False):
-        step_tasks, theta, step_t_start = res
-        step_results = self.get_chunk(step_tasks)
+        if self.grad_reduction == 'workers' and len(res) == 3:
+            res = self.start_grads(res)
+
+        if len(res) == 4:
+            grad_tasks, theta, step_t_start, step_results = res
+            partial_grads = self.get_chunk(grad_tasks)
+        else:
+            step_tasks, theta, step_t_start = res
+            step_results = self.get_chunk(step_tasks)
+            partial_grads = None
 
         _, po_returns, po_lengths = self.collect_po_results(
             step_results)
@@ -535,7 +766,8 @@ class ESOptimizer:
             'Optimizer {} finished running {} episodes, {} timesteps'.format(
                 self.optim_id, episodes_this_step, timesteps_this_step))
 
-        grads, po_theta_max = self.compute_grads(step_results, theta)
+        with profiling.master_times.phase('grads'):
+            grads, po_theta_max = self.compute_grads(step_results, theta, partial_grads)
         if not propose_only:
             update_ratio, theta = self.optimizer.update(
                 theta, -grads + self.l2_coeff * theta)
@@ -592,12 +824,14 @@ class ESOptimizer:
 
             return score
 
-        raw_scores = []
-        for source_optim in archived_optimizers.values():
-            raw_scores.append(cap_score(self.evaluate_theta(source_optim.theta)))
+        thetas = [o.theta for o in archived_optimizers.values()] + \
+            [o.theta for o in optimizers.values()]
+        self.score_matrix.fill(thetas, [self])
 
-        for source_optim in optimizers.values():
-            raw_scores.append(cap_score(self.evaluate_theta(source_optim.theta)))
+        raw_scores = []
+        for theta in thetas:
+            raw_scores.append(cap_score(self.score_matrix.get(theta, self),
+                                        lower_bound, upper_bound))
 
         self.pata_ec = compute_centered_ranks(np.array(raw_scores))
 
@@ -606,8 +840,9 @@ class ESOptimizer:
         best_init_score = None
         best_init_theta = None
 
+        self.score_matrix.fill([o.theta for o in optimizers.values()], [self])
         for source_optim in optimizers.values():
-            score = self.evaluate_theta(source_optim.theta)
+            score = self.score_matrix.get(source_optim.theta, self)
             if best_init_score == None or score > best_init_score:
                 best_init_score = score
                 best_init_theta = np.array(source_optim.theta)
@@ -0,0 +1,141 @@
+# Copyright (c) 2020 Uber Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import concurrent.futures
+import multiprocessing
+import random
+import numpy as np
+import logging
+logger = logging.getLogger(__name__)
+
+EXECUTORS = ['fiber', 'fork', 'process_pool', 'serial']
+
+
+def make_executor(name, num_workers, initializer, initargs=()):
+    '''
+        A pool of workers that run tasks submitted with apply_async(fn, args),
+        which returns a result with ready(), wait(timeout) and get(), as a
+        multiprocessing pool does:
+
+        fiber: a Fiber pool, for workers spread over a cluster
+        fork: a local multiprocessing pool whose workers are forked, so they
+            share the master's noise table copy-on-write
+        process_pool: a local concurrent.futures.ProcessPoolExecutor
+        serial: runs each task in the master when it is submitted, for
+            debugging and profiling
+    '''
+    logger.info('Starting {} executor with {} workers'.format(name, num_workers))
+    if name == 'fiber':
+        import fiber
+        return fiber.get_context('spawn').Pool(
+            num_workers, initializer=initializer, initargs=initargs)
+    elif name == 'fork':
+        return multiprocessing.get_context('fork').Pool(
+            num_workers, initializer=initializer, initargs=initargs)
+    elif name == 'process_pool':
+        return ProcessPoolExecutorPool(num_workers, initializer, initargs)
+    elif name == 'serial':
+        return SerialPool(initializer, initargs)
+    else:
+        raise NotImplementedError('Invalid executor `{}`'.format(name))
+
+
+class FutureResult:
+    ''' a concurrent.futures.Future behind the async result interface '''
+    def __init__(self, future):
+        self.future = future
+
+    def ready(self):
+        return self.future.done()
+
+    def wait(self, timeout=None):
+        concurrent.futures.wait([self.future], timeout=timeout)
+
+    def get(self):
+        return self.future.result()
+
+
+class ProcessPoolExecutorPool:
+    '''
+        ProcessPoolExecutor takes initializer= only from Python 3.7 and
+        cancel_futures= from 3.9, so tasks carry the initializer and run it
+        on the first task in each worker, and terminate cancels what hasn't
+        started itself.
+    '''
+    def __init__(self, num_workers, initializer, initargs):
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=num_workers)
+        self.initializer = initializer
+        self.initargs = initargs
+        self.pending = set()
+
+    def apply_async(self, fn, args=()):
+        future = self.executor.submit(
+            run_initialized, self.initializer, self.initargs, fn, args)
+        self.pending.add(future)
+        future.add_done_callback(self.pending.discard)
+        return FutureResult(future)
+
+    def terminate(self):
+        for future in list(self.pending):
+            future.cancel()
+        self.executor.shutdown(wait=False)
+
+
+worker_initialized = False
+
+
+def run_initialized(initializer, initargs, fn, args):
+    '''fn(*args), after initializer(*initargs) if this process hasn't run it yet'''
+    global worker_initialized
+    if not worker_initialized:
+        initializer(*initargs)
+        worker_initialized = True
+    return fn(*args)
+
+
+class SerialResult:
+    def __init__(self, fn, args):
+        # rollouts reseed the global generators, which in the master would
+        # change every draw that follows
+        np_random_state, random_state = np.random.get_state(), random.getstate()
+        try:
+            self.value, self.error = fn(*args), None
+        except Exception as e:
+            self.value, self.error = None, e
+        finally:
+            np.random.set_state(np_random_state)
+            random.setstate(random_state)
+
+    def ready(self):
+        return True
+
+    def wait(self, timeout=None):
+        pass
+
+    def get(self):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class SerialPool:
+    def __init__(self, initializer, initargs):
+        initializer(*initargs)
+
+    def apply_async(self, fn, args=()):
+        return SerialResult(fn, args)
+
+    def terminate(self):
+        pass
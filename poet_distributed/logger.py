@@ -12,30 +12,141 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-
+import atexit
 import csv
+import glob
+import os
+import time
 from pprint import pformat
+import numpy as np
 import logging
 
 logger = logging.getLogger(__name__)
 
+FLUSH_INTERVAL = 30.0  # seconds between writes of buffered rows
+
 
 class CSVLogger:
-    def __init__(self, fnm, col_names):
+    '''
+        Appends a row of values per log call to fnm. The file stays open and
+        rows are buffered, then written every flush_interval seconds, on
+        close and at exit. With columns=True every flush also writes the
+        rows as an npz chunk of one array per column, see load_columns.
+        Pickling flushes and records how far the file got; an unpickled
+        logger has no open file until resume cuts off whatever was written
+        after that.
+    '''
+    def __init__(self, fnm, col_names, flush_interval=FLUSH_INTERVAL, columns=False):
         logger.info('Creating data logger at {}'.format(fnm))
         self.fnm = fnm
         self.col_names = col_names
-        with open(fnm, 'a', newline='') as f:
-            writer = csv.writer(f, delimiter=',')
-            writer.writerow(col_names)
+        self.col_set = set(col_names)
+        self.flush_interval = flush_interval
+        self.columns = columns
+        self.f = None
+        self.rows = []
+        self.chunk = 0
+        self.size = 0
+        self.last_flush = time.time()
+        self.open()
+        self.writer.writerow(col_names)
+        if columns:
+            os.makedirs(columns_dir(fnm), exist_ok=True)
+        atexit.register(self.close)
         # hold over previous values if empty
         self.vals = {name: None for name in col_names}
 
+    def __getstate__(self):
+        self.flush()
+        state = self.__dict__.copy()
+        del state['f'], state['writer']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.f = None
+
+    def resume(self):
+        '''rewind to the pickled state and keep logging to the file'''
+        self.rewind()
+        self.open()
+        atexit.register(self.close)
+
+    def rewind(self):
+        '''drop the rows and column chunks written after the last flush'''
+        if os.path.exists(self.fnm) and os.path.getsize(self.fnm) > self.size:
+            logger.info('Rewinding {} to {} bytes'.format(self.fnm, self.size))
+            os.truncate(self.fnm, self.size)
+        for path in glob.glob(os.path.join(columns_dir(self.fnm), '*.npz')):
+            if int(os.path.basename(path)[:-len('.npz')]) >= self.chunk:
+                os.remove(path)
+
+    def open(self):
+        if self.f is None:
+            self.f = open(self.fnm, 'a', newline='')
+            self.writer = csv.writer(self.f, delimiter=',')
+
     def log(self, **cols):
-        self.vals.update(cols)
-        logger.info(pformat(self.vals))
-        if any(key not in self.col_names for key in self.vals):
+        if not self.col_set.issuperset(cols):
             raise Exception('CSVLogger given invalid key')
-        with open(self.fnm, 'a', newline='') as f:
-            writer = csv.writer(f, delimiter=',')
-            writer.writerow([self.vals[name] for name in self.col_names])
+        self.vals.update(cols)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(pformat(self.vals))
+        self.rows.append([self.vals[name] for name in self.col_names])
+        if time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.last_flush = time.time()
+        if self.rows:
+            self.open()
+            self.writer.writerows(self.rows)
+            if self.columns:
+                self.write_chunk()
+            self.rows = []
+        if self.f is not None:
+            self.f.flush()
+            self.size = os.fstat(self.f.fileno()).st_size
+
+    def write_chunk(self):
+        arrays = {}
+        for name, values in zip(self.col_names, zip(*self.rows)):
+            try:
+                arrays[name] = np.array([np.nan if v is None else v for v in values],
+                                        dtype=np.float64)
+            except (TypeError, ValueError):
+                arrays[name] = np.array(['' if v is None else str(v) for v in values])
+        path = os.path.join(columns_dir(self.fnm), '{:06d}.npz'.format(self.chunk))
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.rename(tmp_path, path)
+        self.chunk += 1
+
+    def close(self):
+        '''write out buffered rows and let go of the file, log reopens it'''
+        self.flush()
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+
+def columns_dir(fnm):
+    return fnm + '.columns'
+
+
+def load_columns(fnm):
+    '''the columns written by a CSVLogger(fnm, ..., columns=True), as arrays'''
+    chunks = []
+    for path in sorted(glob.glob(os.path.join(columns_dir(fnm), '*.npz'))):
+        with np.load(path) as chunk:
+            chunks.append({name: chunk[name] for name in chunk.files})
+    columns = {}
+    for name in (chunks[0] if chunks else ()):
+        arrays = [chunk[name] for chunk in chunks]
+        if len(set(a.dtype.kind for a in arrays)) > 1:
+            # a column that was empty in some chunks and text in others
+            arrays = [a.astype(str) if a.dtype.kind == 'U' else
+                      np.where(np.isnan(a), '', a.astype(str)) for a in arrays]
+        columns[name] = np.concatenate(arrays)
+    return columns
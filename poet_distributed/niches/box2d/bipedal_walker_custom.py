@@ -14,7 +14,8 @@ from Box2D.b2 import (edgeShape, circleShape, fixtureDef,
 import gym
 from gym import spaces
 from gym.utils import colorize, seeding
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from ...profiling import task_times
 
 # This is simple 4-joints walker robot environment.
 #
@@ -103,6 +104,22 @@ LOWER_FD = fixtureDef(
     maskBits=0x001)
 
 
+# Static terrain shared by every reset with the same (env config, CPPN, seed):
+# the point lists and fixture vertices in creation order, the clouds, and the
+# np_random state left after generating them.
+TerrainTemplate = namedtuple('TerrainTemplate', [
+    'terrain_x', 'terrain_y', 'terrain_poly', 'terrain_bodies',
+    'cloud_poly', 'rng_state',
+])
+
+# Inputs of the CPPN altitude function at each terrain point
+TERRAIN_CPPN_X = (np.arange(TERRAIN_LENGTH) * TERRAIN_STEP - TERRAIN_LENGTH * TERRAIN_STEP / 2.) \
+    * np.pi / (TERRAIN_LENGTH * TERRAIN_STEP / 2.)
+
+TERRAIN_CACHE_SIZE = 64
+terrain_cache = OrderedDict()
+
+
 class ContactDetector(contactListener):
     def __init__(self, env):
         contactListener.__init__(self)
@@ -141,6 +158,7 @@ class BipedalWalkerCustom(gym.Env):
         self.world = Box2D.b2World()
         self.terrain = None
         self.hull = None
+        self.world_key = None
 
         self.prev_shaping = None
         self.fd_polygon = fixtureDef(
@@ -206,22 +224,59 @@ class BipedalWalkerCustom(gym.Env):
     def _seed(self, seed=None):
         self.env_seed = seed
         self.np_random, seed = seeding.np_random(seed)
+        self.fresh_seed = True
         return [seed]
 
     def _destroy(self):
+        self.world_key = None
         if not self.terrain:
             return
-        self.world.contactListener = None
+        self._destroy_walker()
         for t in self.terrain:
             self.world.DestroyBody(t)
         self.terrain = []
+        self.world = None
+
+    def _destroy_walker(self):
+        self.world.contactListener = None
         self.world.DestroyBody(self.hull)
         self.hull = None
         for leg in self.legs:
             self.world.DestroyBody(leg)
         self.legs = []
         self.joints = []
-        self.world = None
+
+    def _terrain_key(self):
+        '''
+            key of the terrain the next reset will generate, or None when it
+            cannot be reused: the env was not freshly seeded with a fixed
+            seed, or the CPPN params cannot be identified
+        '''
+        if not self.fresh_seed or self.env_seed is None:
+            return None
+        if self.env_params is None:
+            params_key = None
+        elif hasattr(self.env_params, 'genome_signature'):
+            params_key = self.env_params.genome_signature()
+        else:
+            return None
+        config_key = tuple(tuple(v) if isinstance(v, list) else v for v in self.config)
+        return (config_key, params_key, self.env_seed)
+
+    def _add_terrain_body(self, fd, vertices, color1, color2):
+        fd.shape.vertices = vertices
+        t = self.world.CreateStaticBody(fixtures=fd)
+        t.color1, t.color2 = color1, color2
+        self.terrain.append(t)
+        self.terrain_bodies.append((fd is self.fd_edge, vertices, color1, color2))
+
+    def _build_terrain(self, template):
+        self.terrain = []
+        self.terrain_bodies = []
+        for is_edge, vertices, color1, color2 in template.terrain_bodies:
+            fd = self.fd_edge if is_edge else self.fd_polygon
+            self._add_terrain_body(fd, vertices, color1, color2)
+        self.terrain.reverse()
 
     def _generate_terrain(self, hardcore):
         #GRASS, STUMP, STAIRS, PIT, _STATES_ = range(5)
@@ -231,23 +286,28 @@ class BipedalWalkerCustom(gym.Env):
         counter = TERRAIN_STARTPAD
         oneshot = False
         self.terrain = []
+        self.terrain_bodies = []
         self.terrain_x = []
         self.terrain_y = []
         pit_diff = 0
+        altitudes = None
+        if self.env_params is not None and self.env_params.altitude_fn is not None:
+            if hasattr(self.env_params, 'altitudes'):
+                altitudes = self.env_params.altitudes(TERRAIN_CPPN_X)
+            else:
+                altitudes = [self.env_params.altitude_fn((x_, ))[0] for x_ in TERRAIN_CPPN_X]
+            # set up front, the tile after the start pad need not be grass
+            y_norm = altitudes[TERRAIN_STARTPAD + 1]
         for i in range(TERRAIN_LENGTH):
             x = i * TERRAIN_STEP
             self.terrain_x.append(x)
 
             if state == self.GRASS and not oneshot:
                 velocity = 0.8 * velocity + 0.01 * np.sign(TERRAIN_HEIGHT - y)
-                if self.env_params is not None and self.env_params.altitude_fn is not None:
+                if altitudes is not None:
                     y += velocity
                     if i > TERRAIN_STARTPAD:
-                        mid = TERRAIN_LENGTH * TERRAIN_STEP / 2.
-                        x_ = (x - mid) * np.pi / mid
-                        y = TERRAIN_HEIGHT + self.env_params.altitude_fn((x_, ))[0]
-                        if i == TERRAIN_STARTPAD+1:
-                            y_norm = self.env_params.altitude_fn((x_, ))[0]
+                        y = TERRAIN_HEIGHT + altitudes[i]
                         y -= y_norm
                 else:
                     if i > TERRAIN_STARTPAD:
@@ -271,18 +331,12 @@ class BipedalWalkerCustom(gym.Env):
                     (x + TERRAIN_STEP, y - 4 * TERRAIN_STEP),
                     (x,              y - 4 * TERRAIN_STEP),
                 ]
-                self.fd_polygon.shape.vertices = poly
-                t = self.world.CreateStaticBody(
-                    fixtures=self.fd_polygon)
-                t.color1, t.color2 = (1, 1, 1), (0.6, 0.6, 0.6)
-                self.terrain.append(t)
-
-                self.fd_polygon.shape.vertices = [
-                    (p[0] + TERRAIN_STEP * pit_gap, p[1]) for p in poly]
-                t = self.world.CreateStaticBody(
-                    fixtures=self.fd_polygon)
-                t.color1, t.color2 = (1, 1, 1), (0.6, 0.6, 0.6)
-                self.terrain.append(t)
+                self._add_terrain_body(
+                    self.fd_polygon, poly, (1, 1, 1), (0.6, 0.6, 0.6))
+
+                self._add_terrain_body(
+                    self.fd_polygon, [(p[0] + TERRAIN_STEP * pit_gap, p[1]) for p in poly],
+                    (1, 1, 1), (0.6, 0.6, 0.6))
                 counter += 2
                 original_y = y
 
@@ -312,11 +366,8 @@ class BipedalWalkerCustom(gym.Env):
                     (x,                      y + countery *
                      TERRAIN_STEP + stump_float * TERRAIN_STEP),
                 ]
-                self.fd_polygon.shape.vertices = poly
-                t = self.world.CreateStaticBody(
-                    fixtures=self.fd_polygon)
-                t.color1, t.color2 = (1, 1, 1), (0.6, 0.6, 0.6)
-                self.terrain.append(t)
+                self._add_terrain_body(
+                    self.fd_polygon, poly, (1, 1, 1), (0.6, 0.6, 0.6))
 
             elif state == self.STAIRS and oneshot:
                 # input parameters: stair_height, stair_width, stair_steps
@@ -337,11 +388,8 @@ class BipedalWalkerCustom(gym.Env):
                         (x + (s * stair_width) * TERRAIN_STEP, y + (-stair_height +
                                                                     s * stair_height * stair_slope) * TERRAIN_STEP),
                     ]
-                    self.fd_polygon.shape.vertices = poly
-                    t = self.world.CreateStaticBody(
-                        fixtures=self.fd_polygon)
-                    t.color1, t.color2 = (1, 1, 1), (0.6, 0.6, 0.6)
-                    self.terrain.append(t)
+                    self._add_terrain_body(
+                        self.fd_polygon, poly, (1, 1, 1), (0.6, 0.6, 0.6))
                 counter = stair_steps * stair_width + 1
 
             elif state == self.STAIRS and not oneshot:
@@ -369,15 +417,10 @@ class BipedalWalkerCustom(gym.Env):
                 (self.terrain_x[i],   self.terrain_y[i]),
                 (self.terrain_x[i + 1], self.terrain_y[i + 1])
             ]
-            self.fd_edge.shape.vertices = poly
-            t = self.world.CreateStaticBody(
-                fixtures=self.fd_edge)
             color = (0.3, 1.0 if i % 2 == 0 else 0.8, 0.3)
-            t.color1 = color
-            t.color2 = color
-            self.terrain.append(t)
+            self._add_terrain_body(self.fd_edge, poly, color, color)
             color = (0.4, 0.6, 0.3)
-            poly += [(poly[1][0], 0), (poly[0][0], 0)]
+            poly = poly + [(poly[1][0], 0), (poly[0][0], 0)]
             self.terrain_poly.append((poly, color))
         self.terrain.reverse()
 
@@ -399,8 +442,17 @@ class BipedalWalkerCustom(gym.Env):
         return self._reset()
 
     def _reset(self):
-        self._destroy()
-        self.world = Box2D.b2World()
+        key = self._terrain_key()
+        self.fresh_seed = False
+        template = terrain_cache.get(key) if key is not None else None
+
+        if template is not None and key == self.world_key:
+            # same static terrain as the last episode: keep the bodies and
+            # only recreate the walker
+            self._destroy_walker()
+        else:
+            self._destroy()
+            self.world = Box2D.b2World()
         self.world.contactListener_bug_workaround = ContactDetector(self)
         self.world.contactListener = self.world.contactListener_bug_workaround
         self.game_over = False
@@ -412,8 +464,29 @@ class BipedalWalkerCustom(gym.Env):
         H = VIEWPORT_H / SCALE
 
         self._set_terrain_number()
-        self._generate_terrain(self.hardcore)
-        self._generate_clouds()
+        if template is None:
+            self._generate_terrain(self.hardcore)
+            self._generate_clouds()
+            if key is not None:
+                terrain_cache[key] = TerrainTemplate(
+                    terrain_x=self.terrain_x,
+                    terrain_y=self.terrain_y,
+                    terrain_poly=self.terrain_poly,
+                    terrain_bodies=self.terrain_bodies,
+                    cloud_poly=self.cloud_poly,
+                    rng_state=self.np_random.get_state())
+                if len(terrain_cache) > TERRAIN_CACHE_SIZE:
+                    terrain_cache.popitem(last=False)
+        else:
+            terrain_cache.move_to_end(key)
+            if key != self.world_key:
+                self._build_terrain(template)
+            self.terrain_x = template.terrain_x
+            self.terrain_y = template.terrain_y
+            self.terrain_poly = template.terrain_poly
+            self.cloud_poly = template.cloud_poly
+            self.np_random.set_state(template.rng_state)
+        self.world_key = key
 
         init_x = TERRAIN_STEP * TERRAIN_STARTPAD / 2
         init_y = TERRAIN_HEIGHT + 2 * LEG_H
@@ -516,19 +589,21 @@ class BipedalWalkerCustom(gym.Env):
             self.joints[3].maxMotorTorque = float(
                 MOTORS_TORQUE * np.clip(np.abs(action[3]), 0, 1))
 
-        self.world.Step(1.0 / FPS, 6 * 30, 2 * 30)
+        with task_times.phase('world_step'):
+            self.world.Step(1.0 / FPS, 6 * 30, 2 * 30)
 
         pos = self.hull.position
         vel = self.hull.linearVelocity
 
-        for i in range(10):
-            self.lidar[i].fraction = 1.0
-            self.lidar[i].p1 = pos
-            self.lidar[i].p2 = (
-                pos[0] + math.sin(1.5 * i / 10.0) * LIDAR_RANGE,
-                pos[1] - math.cos(1.5 * i / 10.0) * LIDAR_RANGE)
-            self.world.RayCast(
-                self.lidar[i], self.lidar[i].p1, self.lidar[i].p2)
+        with task_times.phase('lidar'):
+            for i in range(10):
+                self.lidar[i].fraction = 1.0
+                self.lidar[i].p1 = pos
+                self.lidar[i].p2 = (
+                    pos[0] + math.sin(1.5 * i / 10.0) * LIDAR_RANGE,
+                    pos[1] - math.cos(1.5 * i / 10.0) * LIDAR_RANGE)
+                self.world.RayCast(
+                    self.lidar[i], self.lidar[i].p1, self.lidar[i].p2)
 
         state = [
             # Normal angles up to 0.5 here, but sure more is possible.
@@ -14,9 +14,10 @@
 
 
 from ..core import Niche
-from .model import Model, simulate
+from .model import Model, BatchModel, get_batch_model, simulate, simulate_batch
 from .env import bipedhard_custom, Env_config
 from collections import OrderedDict
+from ...profiling import task_times
 
 DEFAULT_ENV = Env_config(
         name='default_env',
@@ -30,8 +31,8 @@ DEFAULT_ENV = Env_config(
         stair_steps=[])
 
 class Box2DNiche(Niche):
-    def __init__(self, env_configs, env_params, seed, init='random', stochastic=False):
-        self.model = Model(bipedhard_custom)
+    def __init__(self, env_configs, env_params, seed, init='random', stochastic=False, fast_policy=False):
+        self.model = Model(bipedhard_custom, fast_inference=fast_policy)
         if not isinstance(env_configs, list):
             env_configs = [env_configs]
         self.env_configs = OrderedDict()
@@ -40,6 +41,7 @@ class Box2DNiche(Niche):
         self.env_params = env_params
         self.seed = seed
         self.stochastic = stochastic
+        self.fast_policy = fast_policy
         self.model.make_env(seed=seed, env_config=DEFAULT_ENV)
         self.init = init
 
@@ -49,10 +51,12 @@ class Box2DNiche(Niche):
                 "seed": self.seed,
                 "stochastic": self.stochastic,
                 "init": self.init,
+                "fast_policy": self.fast_policy,
                 }
 
     def __setstate__(self, state):
-        self.model = Model(bipedhard_custom)
+        self.fast_policy = state.get("fast_policy", False)
+        self.model = Model(bipedhard_custom, fast_inference=self.fast_policy)
         self.env_configs = state["env_configs"]
         self.env_params = state["env_params"]
         self.seed = state["seed"]
@@ -80,8 +84,9 @@ class Box2DNiche(Niche):
             raise NotImplementedError(
                 'Undefined initialization scheme `{}`'.format(self.init))
 
-    def rollout(self, theta, random_state, eval=False):
-        self.model.set_model_params(theta)
+    def rollout(self, theta, random_state, eval=False, noise=None, noise_std=1.0):
+        with task_times.phase('set_model_params'):
+            self.model.set_model_params(theta, noise=noise, noise_std=noise_std)
         total_returns = 0
         total_length = 0
         if self.stochastic:
@@ -94,3 +99,53 @@ class Box2DNiche(Niche):
             total_returns += returns[0]
             total_length += lengths[0]
         return total_returns / len(self.env_configs), total_length
+
+    def deterministic_eval(self):
+        # simulate reseeds everything with self.seed
+        return not self.stochastic
+
+    def can_batch(self, batch_size):
+        return batch_size > 1 and BatchModel.supports(self.model)
+
+    def get_batch_model(self, batch_size):
+        return get_batch_model(self.model, batch_size)
+
+    def rollout_batch(self, thetas, batch_size, random_state, eval=False):
+        ''' roll out all thetas at once, stepping their envs in lockstep '''
+        if not self.can_batch(batch_size):
+            return super().rollout_batch(thetas, batch_size, random_state, eval=eval)
+
+        batch_model = self.get_batch_model(batch_size)
+        num_policies = 0
+        with task_times.phase('set_model_params'):
+            for theta in thetas:
+                batch_model.set_model_params(num_policies, theta)
+                num_policies += 1
+        return self.simulate_batch(batch_model, num_policies, random_state, eval=eval)
+
+    def rollout_perturbed_batch(self, theta, noises, noise_std, batch_size, random_state):
+        if not self.can_batch(batch_size):
+            return super().rollout_perturbed_batch(theta, noises, noise_std, batch_size, random_state)
+
+        batch_model = self.get_batch_model(batch_size)
+        num_policies = 0
+        with task_times.phase('set_model_params'):
+            for noise in noises:
+                batch_model.set_model_params(num_policies, theta, noise=noise, noise_std=noise_std)
+                num_policies += 1
+        return self.simulate_batch(batch_model, num_policies, random_state)
+
+    def simulate_batch(self, batch_model, num_policies, random_state, eval=False):
+        if self.stochastic:
+            seeds = [random_state.randint(1000000) for _ in range(num_policies)]
+        else:
+            seeds = [self.seed] * num_policies
+
+        total_returns = 0
+        total_length = 0
+        for env_config in self.env_configs.values():
+            returns, lengths = simulate_batch(
+                batch_model, seeds, train_mode=not eval, env_config_this_sim=env_config, env_params=self.env_params)
+            total_returns += returns
+            total_length += lengths
+        return total_returns / len(self.env_configs), total_length
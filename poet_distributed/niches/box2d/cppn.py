@@ -15,6 +15,8 @@
 
 import datetime
 from collections import deque
+import copy
+import hashlib
 import json
 import neat
 from neat.six_util import iteritems, iterkeys
@@ -43,6 +45,58 @@ class PrettyGenome(neat.DefaultGenome):
         return s
 
 
+def compile_genome(genome, config):
+    '''
+        Flatten a single-input genome into (node, activation, bias, response,
+        links) steps that activate_batch can evaluate on a whole array of
+        inputs. Returns None if a node aggregates with anything but sum.
+    '''
+    net = neat.nn.FeedForwardNetwork.create(genome, config)
+    if len(net.input_nodes) != 1:
+        return None
+    program = []
+    for node, act_func, _, bias, response, links in net.node_evals:
+        if genome.nodes[node].aggregation != 'sum':
+            return None
+        program.append((node, act_func, bias, response, links))
+    return net.input_nodes[0], net.output_nodes[0], program
+
+
+def activate_batch(compiled, xs):
+    '''
+        First output of the network for every input in xs. The weighted sums
+        are done with NumPy in the same order as neat, and the activation is
+        neat's own scalar function applied per element, so the result is
+        bit-identical to calling net.activate on each input.
+    '''
+    input_node, output_node, program = compiled
+    n = len(xs)
+    values = {input_node: np.asarray(xs, dtype=np.float64),
+              output_node: np.zeros(n)}
+    for node, act_func, bias, response, links in program:
+        s = 0
+        for i, w in links:
+            s = s + values[i] * w
+        z = np.broadcast_to(bias + response * s, (n,))
+        values[node] = np.fromiter(map(act_func, z.tolist()), np.float64, n)
+    return np.broadcast_to(values[output_node], (n,)).copy()
+
+
+def skip_new_genome_draws(genome_config):
+    '''
+        Consume the `random` draws configure_new makes for a start genome
+        (output nodes, then full input-output connections, as in
+        config-cppn) without building one. Exists only for reproducibility.
+    '''
+    for _ in genome_config.output_keys:
+        for attribute in genome_config.node_gene_type._gene_attributes:
+            attribute.init_value(genome_config)
+    for _ in genome_config.input_keys:
+        for _ in genome_config.output_keys:
+            for attribute in genome_config.connection_gene_type._gene_attributes:
+                attribute.init_value(genome_config)
+
+
 class CppnEnvParams:
     x = np.array([(i - 200 / 2.0) / (200 / 2.0) for i in range(200)])
     def __init__(self, cppn_config_path='config-cppn', genome_path=None):
@@ -64,6 +118,33 @@ class CppnEnvParams:
     def reset_altitude_fn(self):
         net = neat.nn.FeedForwardNetwork.create(self.cppn_genome, self.cppn_config)
         self.altitude_fn = net.activate
+        self.compiled_cppn = compile_genome(self.cppn_genome, self.cppn_config)
+        self.altitude_cache = {}
+        self.signature = None
+
+    def altitudes(self, xs):
+        '''altitude_fn evaluated on every point of xs, cached per grid'''
+        xs = np.asarray(xs, dtype=np.float64)
+        key = xs.tobytes()
+        if key not in self.altitude_cache:
+            if self.compiled_cppn is not None:
+                y = activate_batch(self.compiled_cppn, xs)
+            else:
+                y = np.array([self.altitude_fn((xi, ))[0] for xi in xs])
+            self.altitude_cache[key] = y
+        return self.altitude_cache[key]
+
+    def genome_signature(self):
+        '''digest of the genome's structure and weights, for caching terrains'''
+        if getattr(self, 'signature', None) is None:
+            g = self.cppn_genome
+            nodes = sorted((k, n.bias, n.response, n.activation, n.aggregation)
+                           for k, n in iteritems(g.nodes))
+            connections = sorted((k, c.weight, c.enabled)
+                                 for k, c in iteritems(g.connections))
+            self.signature = hashlib.sha1(
+                repr((nodes, connections)).encode()).hexdigest()
+        return self.signature
 
     def get_mutated_params(self):
         is_valid = False
@@ -75,8 +156,12 @@ class CppnEnvParams:
             is_valid = is_genome_valid(mutated) & (self.cppn_genome.distance(mutated, self.cppn_config.genome_config) > 0)
             if not is_valid:
                 continue
-            net = neat.nn.FeedForwardNetwork.create(mutated, self.cppn_config)
-            y = np.array([net.activate((xi, )) for xi in self.x])
+            compiled = compile_genome(mutated, self.cppn_config)
+            if compiled is not None:
+                y = activate_batch(compiled, self.x)
+            else:
+                net = neat.nn.FeedForwardNetwork.create(mutated, self.cppn_config)
+                y = np.array([net.activate((xi, ))[0] for xi in self.x])
             y -= y[0] # normalize to start at altitude 0
             threshold_ = np.abs(np.max(y))
             is_valid = (threshold_ > 0)
@@ -86,15 +171,30 @@ class CppnEnvParams:
                 mutated.nodes[0].response = (np.random.random() / 2 + 0.25) / threshold_
             if threshold_ > 16:
                 mutated.nodes[0].response = (np.random.random() * 4 + 12) / threshold_
-            res = CppnEnvParams()
-            res.cppn_genome = mutated
-            res.reset_altitude_fn()
+            res = self.with_genome(mutated)
+            # a fresh CppnEnvParams() used to be built here, configuring a
+            # start genome that was then thrown away; only its draws from
+            # `random` are kept, so that seeded runs still match
+            skip_new_genome_draws(res.cppn_config.genome_config)
             return res
 
+    def with_genome(self, genome):
+        '''
+            params for another genome, sharing this neat config except for
+            its node key counter, which each CppnEnvParams keeps to itself
+        '''
+        res = copy.copy(self)
+        res.cppn_config = copy.copy(self.cppn_config)
+        res.cppn_config.genome_config = copy.copy(self.cppn_config.genome_config)
+        res.cppn_config.genome_config.node_indexer = None
+        res.genome_path = None
+        res.cppn_genome = genome
+        res.reset_altitude_fn()
+        return res
+
     def save_xy(self, folder='/tmp'):
         with open(folder + '/' + self.cppn_genome.key + '_xy.json', 'w') as f:
-            net = neat.nn.FeedForwardNetwork.create(self.cppn_genome, self.cppn_config)
-            y = np.array([net.activate((xi, )) for xi in self.x])
+            y = self.altitudes(self.x).reshape(-1, 1)
             f.write(json.dumps({'x': self.x.tolist(), 'y': y.tolist()}))
 
     def to_json(self):
@@ -109,9 +209,7 @@ class CppnEnvParams:
 
 
 def copy_genome(genome):
-    file_path = '/tmp/genome_{}.pickle'.format(time.time())
-    pickled = pickle.dump(genome, open(file_path, 'wb'))
-    return pickle.load(open(file_path, 'rb'))
+    return copy.deepcopy(genome)
 
 def is_genome_valid(g):
     graph = {}
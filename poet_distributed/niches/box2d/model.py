@@ -7,6 +7,8 @@ import numpy as np
 import random
 import json
 from .env import make_env
+from ...policy import read_policy
+from ...profiling import task_times
 import time
 import logging
 logger = logging.getLogger(__name__)
@@ -49,10 +51,18 @@ def sample(p):
     return np.argmax(np.random.multinomial(1, p))
 
 
+def write_params(out, model_params, noise=None, noise_std=1.0):
+    if noise is None:
+        out[:] = model_params
+    else:
+        np.multiply(noise, noise_std, out=out)
+        out += model_params
+
+
 class Model:
     ''' simple feedforward model '''
 
-    def __init__(self, game):
+    def __init__(self, game, fast_inference=False):
         self.output_noise = game.output_noise
         self.env_name = game.env_name
         self.layer_1 = game.layers[0]
@@ -91,18 +101,33 @@ class Model:
 
         idx = 0
         for shape in self.shapes:
-            self.weight.append(np.zeros(shape=shape))
-            self.bias.append(np.zeros(shape=shape[1]))
             self.param_count += (np.product(shape) + shape[1])
             if self.output_noise[idx]:
                 self.param_count += shape[1]
-            log_std = np.zeros(shape=shape[1])
+            idx += 1
+
+        # weights, biases and log stds are views into this one flat buffer
+        self.params = np.zeros(self.param_count)
+        pointer = 0
+        for idx, shape in enumerate(self.shapes):
+            s_w = np.product(shape)
+            self.weight.append(self.params[pointer:pointer + s_w].reshape(shape))
+            pointer += s_w
+            self.bias.append(self.params[pointer:pointer + shape[1]])
+            pointer += shape[1]
+            if self.output_noise[idx]:
+                log_std = self.params[pointer:pointer + shape[1]]
+                pointer += shape[1]
+            else:
+                log_std = np.zeros(shape=shape[1])
             self.bias_log_std.append(log_std)
             out_std = np.exp(self.sigma_factor * log_std + self.sigma_bias)
             self.bias_std.append(out_std)
-            idx += 1
 
         self.render_mode = False
+        self.fast_inference = False
+        if fast_inference:
+            self.enable_fast_inference()
 
     def __repr__(self):
         return "{}".format(self.__dict__)
@@ -112,7 +137,51 @@ class Model:
         self.env = make_env(self.env_name, seed=seed,
                             render_mode=render_mode, env_config=env_config)
 
+    def supports_fast_inference(self):
+        return (not self.rnn_mode and self.time_input == 0 and
+                not any(self.output_noise) and not self.sample_output and
+                all(activation is np.tanh for activation in self.activations))
+
+    def enable_fast_inference(self):
+        '''
+            Switch get_action to a float32 forward pass that reuses
+            preallocated buffers. Each layer's weights followed by its bias
+            form a contiguous (in + 1, out) block of the parameter vector, so
+            the bias is folded into the matmul by keeping a trailing 1 in
+            every layer input.
+        '''
+        assert self.supports_fast_inference()
+        self.params32 = np.zeros(self.param_count, dtype=np.float32)
+        self.weight32 = []
+        self.inputs32 = []
+        self.outputs32 = []
+        pointer = 0
+        for shape in self.shapes:
+            s = (shape[0] + 1) * shape[1]
+            self.weight32.append(self.params32[pointer:pointer + s].reshape(
+                (shape[0] + 1, shape[1])))
+            pointer += s
+            h = np.ones(shape[0] + 1, dtype=np.float32)
+            if self.outputs32:
+                self.outputs32[-1] = h[:-1]
+            self.inputs32.append(h)
+            self.outputs32.append(np.zeros(shape[1], dtype=np.float32))
+        self.fast_inference = True
+        for i in range(len(self.shapes)):
+            self.weight32[i][:-1] = self.weight[i]
+            self.weight32[i][-1] = self.bias[i]
+
+    def get_action_fast(self, x):
+        # returns a buffer that is overwritten by the next call
+        self.inputs32[0][:-1] = x
+        for h, w, out in zip(self.inputs32, self.weight32, self.outputs32):
+            np.dot(h, w, out=out)
+            np.tanh(out, out=out)
+        return out
+
     def get_action(self, x, t=0, mean_mode=False):
+        if self.fast_inference:
+            return self.get_action_fast(x)
         # if mean_mode = True, ignore sampling.
         h = np.array(x).flatten()
         if self.time_input == 1:
@@ -135,30 +204,29 @@ class Model:
 
         return h
 
-    def set_model_params(self, model_params):
-        pointer = 0
+    def set_model_params(self, model_params, noise=None, noise_std=1.0):
+        '''
+            Write model_params, or model_params + noise_std * noise when a
+            noise slice is given, into the parameter buffer in place.
+        '''
+        write_params(self.params, model_params, noise, noise_std)
         for i in range(len(self.shapes)):
-            w_shape = self.shapes[i]
-            b_shape = self.shapes[i][1]
-            s_w = np.product(w_shape)
-            s = s_w + b_shape
-            chunk = np.array(model_params[pointer:pointer + s])
-            self.weight[i] = chunk[:s_w].reshape(w_shape)
-            self.bias[i] = chunk[s_w:].reshape(b_shape)
-            pointer += s
             if self.output_noise[i]:
-                s = b_shape
-                self.bias_log_std[i] = np.array(
-                    model_params[pointer:pointer + s])
                 self.bias_std[i] = np.exp(
                     self.sigma_factor * self.bias_log_std[i] + self.sigma_bias)
                 if self.render_mode:
                     print("bias_std, layer", i, self.bias_std[i])
-                pointer += s
+        if self.fast_inference:
+            self.params32[:] = self.params
 
     def load_model(self, filename):
-        with open(filename) as f:
-            data = json.load(f)
+        if filename.endswith('.npy'):
+            model_params, score, _, _ = read_policy(filename)
+            data = [model_params, score]
+        else:
+            # legacy [theta, score] json
+            with open(filename) as f:
+                data = json.load(f)
         print('loading file %s' % (filename))
         self.data = data
         model_params = np.array(data[0])  # assuming other stuff is in data
@@ -167,6 +235,69 @@ class Model:
     def get_random_model_params(self, stdev=0.1):
         return np.random.randn(self.param_count) * stdev
 
+
+class BatchModel:
+    '''
+        K perturbed copies of a feedforward model, each driving its own env.
+        Shared by every niche in the process, see get_batch_model.
+    '''
+
+    def __init__(self, model, batch_size):
+        assert BatchModel.supports(model)
+        self.model = model
+        self.batch_size = batch_size
+        self.activations = model.activations
+        # One row of parameters per policy, laid out like Model.set_model_params
+        self.params = np.zeros((batch_size, model.param_count))
+        # the forward pass runs in float32 when the model has its fast path
+        # on, the parameters are rounded from float64 the same way
+        self.dtype = np.float32 if model.fast_inference else np.float64
+        self.envs = [make_env(model.env_name, seed=-1, env_config=model.env.config)
+                     for _ in range(batch_size)]
+
+    @staticmethod
+    def supports(model):
+        return (not model.rnn_mode and model.time_input == 0 and
+                not any(model.output_noise) and not model.sample_output)
+
+    def set_model_params(self, k, model_params, noise=None, noise_std=1.0):
+        write_params(self.params[k], model_params, noise, noise_std)
+
+    def stack_layers(self, rows):
+        ''' gather (len(rows), in, out) weights and (len(rows), out) biases '''
+        params = self.params[rows].astype(self.dtype, copy=False)
+        n = len(rows)
+        weights, biases = [], []
+        pointer = 0
+        for w_shape in self.model.shapes:
+            s_w = np.prod(w_shape)
+            weights.append(params[:, pointer:pointer + s_w].reshape((n,) + w_shape))
+            pointer += s_w
+            biases.append(params[:, pointer:pointer + w_shape[1]])
+            pointer += w_shape[1]
+        return weights, biases
+
+    def get_action(self, x, weights, biases):
+        h = x.astype(self.dtype, copy=False)
+        for w, b, activation in zip(weights, biases, self.activations):
+            h = activation(np.matmul(h[:, None, :], w)[:, 0, :] + b)
+        return h
+
+
+# BatchModels by policy layout. Niches share them, and so their envs, since
+# simulate_batch sets every env's config, CPPN params and seed before each
+# episode; one per niche would keep batch_size Box2D worlds per niche alive.
+batch_models = {}
+
+
+def get_batch_model(model, batch_size):
+    ''' a BatchModel of at least batch_size policies laid out like model '''
+    key = (model.env_name, tuple(model.shapes), model.fast_inference)
+    batch_model = batch_models.get(key)
+    if batch_model is None or batch_model.batch_size < batch_size:
+        batch_model = batch_models[key] = BatchModel(model, batch_size)
+    return batch_model
+
 def simulate(model, seed, train_mode=False, render_mode=False, num_episode=5,
              max_len=-1, env_config_this_sim=None, env_params=None):
     reward_list = []
@@ -195,7 +326,8 @@ def simulate(model, seed, train_mode=False, render_mode=False, num_episode=5,
         if model.rnn_mode:
             model.reset()
 
-        obs = model.env.reset()
+        with task_times.phase('reset'):
+            obs = model.env.reset()
         if obs is None:
             obs = np.zeros(model.input_size)
 
@@ -207,15 +339,16 @@ def simulate(model, seed, train_mode=False, render_mode=False, num_episode=5,
                 if RENDER_DELAY:
                     time.sleep(0.01)
 
-            if model.rnn_mode:
-                model.update(obs, t)
-                action = model.get_action()
-            else:
-                if MEAN_MODE:
-                    action = model.get_action(
-                        obs, t=t, mean_mode=(not train_mode))
+            with task_times.phase('get_action'):
+                if model.rnn_mode:
+                    model.update(obs, t)
+                    action = model.get_action()
                 else:
-                    action = model.get_action(obs, t=t, mean_mode=False)
+                    if MEAN_MODE:
+                        action = model.get_action(
+                            obs, t=t, mean_mode=(not train_mode))
+                    else:
+                        action = model.get_action(obs, t=t, mean_mode=False)
 
             obs, reward, done, info = model.env.step(action)
             total_reward += reward
@@ -229,3 +362,65 @@ def simulate(model, seed, train_mode=False, render_mode=False, num_episode=5,
         t_list.append(t)
 
     return reward_list, t_list
+
+
+def simulate_batch(batch_model, seeds, train_mode=False, max_len=-1,
+                   env_config_this_sim=None, env_params=None):
+    '''
+        Run one episode for each of the first len(seeds) policies of
+        batch_model, stepping their envs in lockstep. Equivalent to calling
+        simulate(num_episode=1) once per policy.
+    '''
+    num_policies = len(seeds)
+    envs = batch_model.envs[:num_policies]
+
+    max_episode_length = 2000
+
+    if train_mode and max_len > 0:
+        if max_len < max_episode_length:
+            max_episode_length = max_len
+
+    obs = np.zeros((num_policies, batch_model.model.input_size))
+    for k, (env, seed) in enumerate(zip(envs, seeds)):
+        if (seed >= 0):
+            random.seed(seed)
+            np.random.seed(seed)
+            env.seed(seed)
+
+        if env_config_this_sim:
+            env.set_env_config(env_config_this_sim)
+
+        # also when None, the env may have run another niche's terrain
+        env.augment(env_params)
+
+        with task_times.phase('reset'):
+            o = env.reset()
+        if o is not None:
+            obs[k] = o
+
+    reward_list = np.zeros(num_policies)
+    t_list = np.full(num_policies, max_episode_length - 1, dtype='int')
+
+    # rows still running; the stacked weights are only re-gathered when an
+    # episode finishes
+    active = np.arange(num_policies)
+    weights, biases = batch_model.stack_layers(active)
+    for t in range(max_episode_length):
+        with task_times.phase('get_action'):
+            actions = batch_model.get_action(obs[active], weights, biases)
+
+        done_rows = []
+        for j, k in enumerate(active):
+            obs[k], reward, done, info = envs[k].step(actions[j])
+            reward_list[k] += reward
+            if done:
+                t_list[k] = t
+                done_rows.append(j)
+
+        if done_rows:
+            active = np.delete(active, done_rows)
+            if len(active) == 0:
+                break
+            weights, biases = batch_model.stack_layers(active)
+
+    return reward_list, t_list
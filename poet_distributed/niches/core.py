@@ -14,6 +14,10 @@
 
 
 class Niche:
+    def deterministic_eval(self):
+        ''' whether every eval rollout of a given theta gives the same result '''
+        return False
+
     def rollout_batch(self, thetas, batch_size, random_state, eval=False):
         import numpy as np
         returns = np.zeros(batch_size)
@@ -24,3 +28,15 @@ class Niche:
                 theta, random_state=random_state, eval=eval)
 
         return returns, lengths
+
+    def rollout_perturbed_batch(self, theta, noises, noise_std, batch_size, random_state):
+        ''' roll out theta + noise_std * noise for each noise slice '''
+        import numpy as np
+        returns = np.zeros(batch_size)
+        lengths = np.zeros(batch_size, dtype='int')
+
+        for i, noise in enumerate(noises):
+            returns[i], lengths[i] = self.rollout(
+                theta, random_state=random_state, noise=noise, noise_std=noise_std)
+
+        return returns, lengths
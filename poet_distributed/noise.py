@@ -5,6 +5,8 @@
 # Modifications Copyright (c) 2020 Uber Technologies, Inc.
 
 
+import os
+import tempfile
 import numpy as np
 import logging
 
@@ -12,21 +14,68 @@ logger = logging.getLogger(__name__)
 
 debug = False
 
+NOISE_SEED = 42
+
+# Format version of the table produced by each generator. Bump whenever the
+# contents for a given (seed, count) would change, so that stale on-disk
+# tables are never picked up.
+NOISE_FORMAT_VERSIONS = {
+    'randn': 1,
+    'pcg64': 2,
+}
+
+# Numbers sampled per chunk. Each pcg64 chunk draws from its own substream, so
+# the table does not depend on how many threads fill it.
+NOISE_CHUNK_SIZE = 1 << 22
+
+
+def default_noise_count():
+    # 1 gigabyte of 32-bit numbers.
+    return 250000000 if not debug else 1000000
+
+
+def sample_noise(out, seed, generator='randn', num_threads=1):
+    '''Fill `out` in place, one chunk at a time'''
+    chunks = [out[i:i + NOISE_CHUNK_SIZE]
+              for i in range(0, len(out), NOISE_CHUNK_SIZE)]
+    if generator == 'randn':
+        # Sequential draws from one RandomState give the same numbers as a
+        # single randn(count) call, with only a chunk-sized 64-bit temporary.
+        rs = np.random.RandomState(seed)
+        for chunk in chunks:
+            chunk[:] = rs.randn(len(chunk))  # 64-bit to 32-bit conversion here
+    elif generator == 'pcg64':
+        streams = np.random.SeedSequence(seed).spawn(len(chunks))
+
+        def fill(i):
+            np.random.Generator(np.random.PCG64(streams[i])).standard_normal(
+                dtype=np.float32, out=chunks[i])
+
+        if num_threads > 1:
+            from multiprocessing.pool import ThreadPool
+            with ThreadPool(num_threads) as pool:
+                pool.map(fill, range(len(chunks)))
+        else:
+            for i in range(len(chunks)):
+                fill(i)
+    else:
+        raise NotImplementedError(
+            'Invalid noise generator `{}`'.format(generator))
+
 
 class SharedNoiseTable(object):
-    def __init__(self):
+    def __init__(self, seed=NOISE_SEED, count=None, generator='randn', num_threads=1):
         import ctypes
         import multiprocessing
-        seed = 42
-        # 1 gigabyte of 32-bit numbers. Will actually sample 2 gigabytes below.
-        count = 250000000 if not debug else 1000000
-        logger.info('Sampling {} random numbers with seed {}'.format(
-            count, seed))
+        if count is None:
+            count = default_noise_count()
+        self.format_version = NOISE_FORMAT_VERSIONS[generator]
+        logger.info('Sampling {} random numbers with seed {} ({} v{})'.format(
+            count, seed, generator, self.format_version))
         self._shared_mem = multiprocessing.Array(ctypes.c_float, count)
         self.noise = np.ctypeslib.as_array(self._shared_mem.get_obj())
         assert self.noise.dtype == np.float32
-        self.noise[:] = np.random.RandomState(seed).randn(
-            count)  # 64-bit to 32-bit conversion here
+        sample_noise(self.noise, seed, generator, num_threads)
         logger.info('Sampled {} bytes'.format(self.noise.size * 4))
 
     def get(self, i, dim):
@@ -34,3 +83,67 @@ class SharedNoiseTable(object):
 
     def sample_index(self, stream, dim):
         return stream.randint(0, len(self.noise) - dim + 1)
+
+    def gather(self, inds, dim):
+        '''Row i of the result is a copy of get(inds[i], dim)'''
+        # every length-dim window of the table, as a view without copying
+        windows = np.lib.stride_tricks.as_strided(
+            self.noise, shape=(len(self.noise) - dim + 1, dim),
+            strides=self.noise.strides * 2, writeable=False)
+        return windows[inds]
+
+
+class MemmapNoiseTable(SharedNoiseTable):
+    '''
+        Noise table built once per host and memory-mapped read-only by every
+        process, so that all workers share a single page-cached copy.
+    '''
+    def __init__(self, seed=NOISE_SEED, count=None, generator='randn', num_threads=1,
+                 noise_dir=None):
+        if count is None:
+            count = default_noise_count()
+        self.format_version = NOISE_FORMAT_VERSIONS[generator]
+        if noise_dir is None:
+            noise_dir = os.path.join(tempfile.gettempdir(), 'poet_noise')
+        os.makedirs(noise_dir, exist_ok=True)
+        self.path = os.path.join(noise_dir, 'noise.v{}.seed{}.count{}.npy'.format(
+            self.format_version, seed, count))
+
+        if not os.path.exists(self.path):
+            self._build(seed, count, generator, num_threads)
+
+        self.noise = np.load(self.path, mmap_mode='r')
+        assert self.noise.dtype == np.float32
+        assert self.noise.shape == (count,)
+        logger.info('Mapped {} bytes of noise from {}'.format(
+            self.noise.size * 4, self.path))
+
+    def _build(self, seed, count, generator, num_threads):
+        import fcntl
+        # Only one process per host builds the table, the others wait on the
+        # lock and then find the finished file.
+        with open(self.path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(self.path):
+                return
+            logger.info('Sampling {} random numbers with seed {} into {}'.format(
+                count, seed, self.path))
+            tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+            noise = np.lib.format.open_memmap(
+                tmp_path, mode='w+', dtype=np.float32, shape=(count,))
+            sample_noise(noise, seed, generator, num_threads)
+            noise.flush()
+            del noise
+            os.rename(tmp_path, self.path)
+            logger.info('Sampled {} bytes'.format(count * 4))
+
+
+def make_noise_table(backend='shared', generator='randn', num_threads=1, noise_dir=None):
+    if backend == 'shared':
+        return SharedNoiseTable(generator=generator, num_threads=num_threads)
+    elif backend == 'memmap':
+        return MemmapNoiseTable(generator=generator, num_threads=num_threads,
+                                noise_dir=noise_dir)
+    else:
+        raise NotImplementedError(
+            'Invalid noise backend `{}`'.format(backend))
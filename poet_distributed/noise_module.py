@@ -13,6 +13,21 @@
 # limitations under the License.
 
 
-from .noise import SharedNoiseTable
+from .noise import make_noise_table
 
-noise = SharedNoiseTable()
+noise = None
+
+
+def get_noise(noise_config=None):
+    '''Create this process' noise table on first use'''
+    global noise
+    if noise is None:
+        noise = make_noise_table(**(noise_config or {}))
+    return noise
+
+
+def noise_config_from_args(args):
+    return dict(backend=args.noise_backend,
+                generator=args.noise_generator,
+                num_threads=args.noise_threads,
+                noise_dir=args.noise_dir)
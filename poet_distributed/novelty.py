@@ -27,18 +27,63 @@ def euclidean_distance(x, y):
     return np.sqrt(a**2 + b**2)
 
 
-def compute_novelty_vs_archive(archived_optimizers, optimizers, niche, k, low, high):
-    distances = []
-    niche.update_pata_ec(archived_optimizers, optimizers, low, high)
-    for point in archived_optimizers.values():
-        distances.append(euclidean_distance(point.pata_ec, niche.pata_ec))
+class NoveltyIndex:
+    '''
+        PATA-EC vectors of the archived and active niches, one row each.
+        Rows are padded with their last value, like euclidean_distance pads
+        the shorter vector, so a whole batch of queries is answered with one
+        vectorized distance computation.
+    '''
+    def __init__(self, capacity=16, width=16):
+        self.vectors = np.zeros((capacity, width))
+        self.lengths = np.zeros(capacity, dtype=int)
+        self.rows = {}
 
-    for point in optimizers.values():
-        distances.append(euclidean_distance(point.pata_ec, niche.pata_ec))
+    def __len__(self):
+        return len(self.rows)
 
+    def _grow(self, capacity, width):
+        old_capacity, old_width = self.vectors.shape
+        vectors = np.zeros((capacity, width))
+        vectors[:old_capacity, :old_width] = self.vectors
+        # keep padding with the last value of each row
+        vectors[:old_capacity, old_width:] = self.vectors[:, -1:]
+        lengths = np.zeros(capacity, dtype=int)
+        lengths[:old_capacity] = self.lengths
+        self.vectors, self.lengths = vectors, lengths
+
+    def add(self, key, vector):
+        '''add or replace the vector stored under key'''
+        vector = np.asarray(vector)
+        capacity, width = self.vectors.shape
+        if key not in self.rows and len(self) == capacity or len(vector) > width:
+            self._grow(capacity * 2 if len(self) == capacity else capacity,
+                       max(width, 2 ** int(np.ceil(np.log2(len(vector))))))
+        row = self.rows.setdefault(key, len(self))
+        self.vectors[row, :len(vector)] = vector
+        self.vectors[row, len(vector):] = vector[-1]
+        self.lengths[row] = len(vector)
+
+    def novelty(self, queries, k):
+        '''mean distance of each query to its k nearest stored vectors'''
+        n = len(self)
+        width = max([self.vectors.shape[1]] + [len(q) for q in queries])
+        if width > self.vectors.shape[1]:
+            self._grow(self.vectors.shape[0], width)
+        padded = np.empty((len(queries), width))
+        query_lengths = np.empty(len(queries), dtype=int)
+        for i, q in enumerate(queries):
+            padded[i, :len(q)] = q
+            padded[i, len(q):] = q[-1]
+            query_lengths[i] = len(q)
+
+        # only compare up to the longer of each pair of vectors
+        mask = np.arange(width) < np.maximum(
+            self.lengths[:n][None, :, None], query_lengths[:, None, None])
+        diff = (padded[:, None, :] - self.vectors[None, :n, :]) * mask
+        distances = np.sqrt(np.einsum('qnw,qnw->qn', diff, diff))
+
+        k = min(k, n)
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        return np.take_along_axis(distances, nearest, axis=1).mean(axis=1)
 
-    # Pick k nearest neighbors
-    distances = np.array(distances)
-    top_k_indicies = (distances).argsort()[:k]
-    top_k = distances[top_k_indicies]
-    return top_k.mean()
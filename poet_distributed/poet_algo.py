@@ -13,18 +13,30 @@
 # limitations under the License.
 
 
-from .logger import CSVLogger
+from .logger import CSVLogger, columns_dir
 import logging
 logger = logging.getLogger(__name__)
 import numpy as np
 from poet_distributed.es import ESOptimizer
 from poet_distributed.es import initialize_worker_fiber
+from poet_distributed.es import wait_for_any, EVAL_CACHE_SIZE
+from poet_distributed.noise_module import noise_config_from_args
+from poet_distributed.executors import make_executor
+from poet_distributed.broadcast import ParameterStore, BoundedCache
+from poet_distributed.score_matrix import ScoreMatrix
 from collections import OrderedDict
 from poet_distributed.niches.box2d.env import Env_config
 from poet_distributed.niches.box2d.cppn import CppnEnvParams
 from poet_distributed.reproduce_ops import Reproducer
-from poet_distributed.novelty import compute_novelty_vs_archive
+from poet_distributed.novelty import NoveltyIndex
+from poet_distributed.checkpoint import save_checkpoint, load_checkpoint
+from poet_distributed import profiling
+import glob
+import itertools
 import json
+import os
+import random
+import shutil
 
 
 def construct_niche_fns_from_env(args, env, env_params, seed):
@@ -35,7 +47,8 @@ def construct_niche_fns_from_env(args, env, env_params, seed):
                             env_params=env_params,
                             seed=seed,
                             init=args.init,
-                            stochastic=args.stochastic)
+                            stochastic=args.stochastic,
+                            fast_policy=args.fast_policy)
 
         return make_niche
 
@@ -50,18 +63,11 @@ class MultiESOptimizer:
 
         self.args = args
 
-        import fiber as mp
-
-        mp_ctx = mp.get_context('spawn')
-        manager = mp_ctx.Manager()
-        self.manager = manager
-        self.fiber_shared = {
-                "niches": manager.dict(),
-                "thetas": manager.dict(),
-        }
-        self.fiber_pool = mp_ctx.Pool(args.num_workers, initializer=initialize_worker_fiber,
-                initargs=(self.fiber_shared["thetas"],
-                    self.fiber_shared["niches"]))
+        self.store = ParameterStore(args.broadcast_dir)
+        self.score_matrix = ScoreMatrix()
+        self.eval_cache = BoundedCache(EVAL_CACHE_SIZE)
+        self.novelty_index = NoveltyIndex()
+        self.fiber_pool = self.make_pool(args)
 
         self.ANNECS = 0
         self.env_registry = OrderedDict()
@@ -69,7 +75,15 @@ class MultiESOptimizer:
         self.env_reproducer = Reproducer(args)
         self.optimizers = OrderedDict()
         self.archived_optimizers = OrderedDict()
-       
+        self.checkpoint_dir = args.log_file + '/checkpoint'
+        self.profile_logger = None
+
+        if args.resume:
+            # the niches and the profile log come from the checkpoint, see resume()
+            return
+        if args.profile:
+            self.profile_logger = self.make_profile_logger()
+
         env = Env_config(
             name='flat',
             ground_roughness=0,
@@ -101,7 +115,7 @@ class MultiESOptimizer:
         return ESOptimizer(
             optim_id=optim_id,
             fiber_pool=self.fiber_pool,
-            fiber_shared=self.fiber_shared,
+            store=self.store,
             theta=theta,
             make_niche=niche_fn,
             learning_rate=self.args.learning_rate,
@@ -118,8 +132,14 @@ class MultiESOptimizer:
             returns_normalization=self.args.returns_normalization,
             noise_limit=self.args.noise_limit,
             log_file=self.args.log_file,
+            log_columns=self.args.log_columns,
             created_at=created_at,
-            is_candidate=is_candidate)
+            is_candidate=is_candidate,
+            num_chunk_tasks=self.args.num_workers * self.args.tasks_per_worker,
+            score_matrix=self.score_matrix,
+            grad_reduction=self.args.grad_reduction,
+            num_grad_tasks=self.args.num_workers,
+            eval_cache=self.eval_cache)
 
 
     def add_optimizer(self, env, cppn_params, seed, created_at=0, model_params=None):
@@ -143,16 +163,78 @@ class MultiESOptimizer:
         assert optim_id in self.env_registry.keys()
         self.env_registry.pop(optim_id)
         logger.info('Archived {} '.format(optim_id))
+        # archived optimizers log nothing more, don't hold their files open
+        o.data_logger.close()
+        o.unpublish_niche()
         self.archived_optimizers[optim_id] = o
 
-    def ind_es_step(self, iteration):
-        tasks = [o.start_step() for o in self.optimizers.values()]
-
-        for optimizer, task in zip(self.optimizers.values(), tasks):
+    def make_profile_logger(self):
+        return CSVLogger(self.log_prefix() + 'profile.log', profiling.profile_columns())
+
+    def log_prefix(self):
+        return self.args.log_file + '/' + self.args.log_file.split('/')[-1] + '.'
+
+    def remove_stale_logs(self):
+        '''delete the logs and policies of optimizers the checkpoint doesn't know'''
+        known = {self.log_prefix() + 'profile.log'}
+        for o in itertools.chain(self.optimizers.values(), self.archived_optimizers.values()):
+            known.update((o.data_logger.fnm, columns_dir(o.data_logger.fnm), o.filename_best))
+        for suffix in ('.log', '.log.columns', '.best.npy'):
+            for path in glob.glob(glob.escape(self.log_prefix()) + '*' + suffix):
+                if path in known:
+                    continue
+                logger.info('Removing {}, written after the checkpoint'.format(path))
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+
+    def make_pool(self, args):
+        return make_executor(args.executor, args.num_workers,
+                initializer=initialize_worker_fiber,
+                initargs=(self.store,
+                    noise_config_from_args(args),
+                    args.profile))
+
+    def stream_ready(self, pending):
+        '''
+            yield (key, (optimizer, task)) items of `pending` as their tasks
+            finish; items added to `pending` meanwhile are picked up too
+        '''
+        while pending:
+            ready = [key for key, (optimizer, task) in pending.items()
+                     if optimizer.chunk_ready(task)]
+            if not ready:
+                wait_for_any(task for _, task in pending.values())
+                continue
+            for key in ready:
+                yield key, pending.pop(key)
 
-            optimizer.theta, stats = optimizer.get_step(task)
-            self_eval_task = optimizer.start_theta_eval(optimizer.theta)
-            self_eval_stats = optimizer.get_theta_eval(self_eval_task)
+    def ind_es_step(self, iteration):
+        pending = OrderedDict(
+            (('step', optim_id), (o, o.start_step()))
+            for optim_id, o in self.optimizers.items())
+        # draw the self-eval seeds up front, in niche order, so that they do
+        # not depend on which step happens to finish first
+        eval_seeds = OrderedDict(
+            (optim_id, o.draw_rs_seeds(o.eval_batches_per_step))
+            for optim_id, o in self.optimizers.items())
+        step_stats = {}
+
+        # apply each gradient and submit the self-eval as soon as its step is
+        # in, so the pool stays busy with the remaining niches meanwhile
+        for (kind, optim_id), (optimizer, task) in self.stream_ready(pending):
+            if kind == 'step' and optimizer.grad_reduction == 'workers':
+                pending[('grads', optim_id)] = (optimizer, optimizer.start_grads(task))
+                continue
+            if kind != 'eval':
+                optimizer.theta, step_stats[optim_id] = optimizer.get_step(task)
+                pending[('eval', optim_id)] = (optimizer, optimizer.start_theta_eval(
+                    optimizer.theta, rs_seeds=eval_seeds.pop(optim_id)))
+                continue
+
+            stats = step_stats.pop(optim_id)
+            self_eval_stats = optimizer.get_theta_eval(task)
 
             logger.info('Iter={} Optimizer {} theta_mean {} best po {} iteration spent {}'.format(
                 iteration, optimizer.optim_id, self_eval_stats.eval_returns_mean,
@@ -163,44 +245,59 @@ class MultiESOptimizer:
 
     def transfer(self, propose_with_adam, checkpointing, reset_optimizer):
         logger.info('Computing direct transfers...')
-        proposal_targets = {}
-        for source_optim in self.optimizers.values():
-            source_tasks = []
-            proposal_targets[source_optim] = []
-            for target_optim in [o for o in self.optimizers.values()
-                                    if o is not source_optim]:
-                task = target_optim.start_theta_eval(
-                    source_optim.theta)
-                source_tasks.append((task, target_optim))
-
-            for task, target_optim in source_tasks:
-                stats = target_optim.get_theta_eval(task)
-
-                try_proposal = target_optim.update_dicts_after_transfer(source_optim_id=source_optim.optim_id,
-                                    source_optim_theta=source_optim.theta,
-                                    stats=stats, keyword='theta')
-                if try_proposal:
-                    proposal_targets[source_optim].append(target_optim)
+        pairs = [(source_optim, target_optim)
+                 for source_optim in self.optimizers.values()
+                 for target_optim in self.optimizers.values()
+                 if target_optim is not source_optim]
+
+        # the whole transfer matrix goes out in one wave
+        pending = OrderedDict(
+            (i, (target_optim, target_optim.start_theta_eval(source_optim.theta)))
+            for i, (source_optim, target_optim) in enumerate(pairs))
+        direct_stats = {}
+        for i, (target_optim, task) in self.stream_ready(pending):
+            direct_stats[i] = target_optim.get_theta_eval(task)
+
+        # logs and ties between equal scores depend on the order results
+        # are applied in, so keep it the same as a serial sweep
+        proposal_pairs = []
+        for i, (source_optim, target_optim) in enumerate(pairs):
+            try_proposal = target_optim.update_dicts_after_transfer(source_optim_id=source_optim.optim_id,
+                                source_optim_theta=source_optim.theta,
+                                stats=direct_stats[i], keyword='theta')
+            if try_proposal:
+                proposal_pairs.append((source_optim, target_optim))
 
         logger.info('Computing proposal transfers...')
-        for source_optim in self.optimizers.values():
-            source_tasks = []
-            for target_optim in [o for o in self.optimizers.values()
-                                    if o is not source_optim]:
-                if target_optim in proposal_targets[source_optim]:
-                    task = target_optim.start_step(source_optim.theta)
-                    source_tasks.append((task, target_optim))
-
-            for task, target_optim in source_tasks:
-                proposed_theta, _ = target_optim.get_step(
+        # draw seeds as a serial sweep would: per source, the steps of all
+        # its targets and then their evals
+        step_seeds, eval_seeds = [], []
+        for _, group in itertools.groupby(proposal_pairs, key=lambda pair: pair[0]):
+            group = [target_optim for _, target_optim in group]
+            step_seeds.extend(o.draw_rs_seeds(o.batches_per_chunk) for o in group)
+            eval_seeds.extend(o.draw_rs_seeds(o.eval_batches_per_step) for o in group)
+
+        pending = OrderedDict(
+            (('step', i), (target_optim, target_optim.start_step(
+                source_optim.theta, rs_seeds=step_seeds[i])))
+            for i, (source_optim, target_optim) in enumerate(proposal_pairs))
+        proposed_thetas, proposal_stats = {}, {}
+        for (kind, i), (target_optim, task) in self.stream_ready(pending):
+            if kind == 'step' and target_optim.grad_reduction == 'workers':
+                pending[('grads', i)] = (target_optim, target_optim.start_grads(task))
+                continue
+            if kind != 'eval':
+                proposed_thetas[i], _ = target_optim.get_step(
                     task, propose_with_adam=propose_with_adam, propose_only=True)
+                pending[('eval', i)] = (target_optim, target_optim.start_theta_eval(
+                    proposed_thetas[i], rs_seeds=eval_seeds[i]))
+            else:
+                proposal_stats[i] = target_optim.get_theta_eval(task)
 
-                proposal_eval_task = target_optim.start_theta_eval(proposed_theta)
-                proposal_eval_stats = target_optim.get_theta_eval(proposal_eval_task)
-
-                target_optim.update_dicts_after_transfer(source_optim_id=source_optim.optim_id,
-                    source_optim_theta=proposed_theta,
-                    stats=proposal_eval_stats, keyword='proposal')
+        for i, (source_optim, target_optim) in enumerate(proposal_pairs):
+            target_optim.update_dicts_after_transfer(source_optim_id=source_optim.optim_id,
+                source_optim_theta=proposed_thetas[i],
+                stats=proposal_stats[i], keyword='proposal')
 
         logger.info('Considering transfers...')
         for o in self.optimizers.values():
@@ -261,19 +358,43 @@ class MultiESOptimizer:
     def get_child_list(self, parent_list, max_children):
         child_list = []
 
-        mutation_trial = 0
-        while mutation_trial < max_children:
+        candidates = []
+        # candidates are drawn one after the other, as they always were, so
+        # that a seeded run gets the same children; only their evals are
+        # batched
+        for _ in range(max_children):
             new_env_config, new_cppn_params, seed, parent_optim_id = self.get_new_env(parent_list)
-            mutation_trial += 1
             if self.pass_dedup(new_env_config):
                 o = self.create_optimizer(new_env_config, new_cppn_params, seed, is_candidate=True)
-                score = o.evaluate_theta(self.optimizers[parent_optim_id].theta)
-                if self.pass_mc(score):
-                    novelty_score = compute_novelty_vs_archive(self.archived_optimizers, self.optimizers, o, k=5,
-                                        low=self.args.mc_lower, high=self.args.mc_upper)
-                    logger.debug("{} passed mc, novelty score {}".format(score, novelty_score))
-                    child_list.append((new_env_config, new_cppn_params, seed, parent_optim_id, novelty_score))
-                del o
+                candidates.append((new_env_config, new_cppn_params, seed, parent_optim_id, o))
+
+        # MC check of every candidate in one wave
+        self.score_matrix.fill_cells([(self.optimizers[parent_optim_id].theta, o)
+                                      for _, _, _, parent_optim_id, o in candidates])
+        survivors = []
+        for candidate in candidates:
+            _, _, _, parent_optim_id, o = candidate
+            score = self.score_matrix.get(self.optimizers[parent_optim_id].theta, o)
+            if self.pass_mc(score):
+                logger.debug("{} passed mc".format(score))
+                survivors.append(candidate)
+
+        # then the PATA-EC rows of the survivors, also in one wave
+        self.score_matrix.fill(
+            [o.theta for o in self.archived_optimizers.values()] +
+            [o.theta for o in self.optimizers.values()],
+            [o for _, _, _, _, o in survivors])
+        for _, _, _, _, o in survivors:
+            o.update_pata_ec(self.archived_optimizers, self.optimizers,
+                             self.args.mc_lower, self.args.mc_upper)
+        novelty_scores = self.novelty_index.novelty(
+            [o.pata_ec for _, _, _, _, o in survivors], k=5) if survivors else []
+
+        for (new_env_config, new_cppn_params, seed, parent_optim_id, o), novelty_score in zip(
+                survivors, novelty_scores):
+            logger.debug("{} novelty score {}".format(o.optim_id, novelty_score))
+            child_list.append((new_env_config, new_cppn_params, seed, parent_optim_id, novelty_score))
+        del candidates, survivors
 
         #sort child list according to novelty for high to low
         child_list = sorted(child_list,key=lambda x: x[4], reverse=True)
@@ -292,13 +413,25 @@ class MultiESOptimizer:
             logger.info("list of niches to delete")
             logger.info(list_delete)
 
-            for optim in self.optimizers.values():
-                optim.update_pata_ec(self.archived_optimizers, self.optimizers, self.args.mc_lower, self.args.mc_upper)
+            # evaluate every theta missing from the score matrix in one wave,
+            # the pata_ec updates below then only read from it
+            all_optims = list(self.optimizers.values()) + list(self.archived_optimizers.values())
+            all_thetas = [o.theta for o in all_optims]
+            with profiling.master_times.phase('pata_ec'):
+                self.score_matrix.prune(all_thetas, all_optims)
+                self.score_matrix.fill(all_thetas, all_optims)
 
-            for optim in self.archived_optimizers.values():
-                optim.update_pata_ec(self.archived_optimizers, self.optimizers, self.args.mc_lower, self.args.mc_upper)
+                for optim in self.optimizers.values():
+                    optim.update_pata_ec(self.archived_optimizers, self.optimizers, self.args.mc_lower, self.args.mc_upper)
 
-            child_list = self.get_child_list(list_repro, max_children)
+                for optim in self.archived_optimizers.values():
+                    optim.update_pata_ec(self.archived_optimizers, self.optimizers, self.args.mc_lower, self.args.mc_upper)
+
+                for optim in all_optims:
+                    self.novelty_index.add(optim.optim_id, optim.pata_ec)
+
+            with profiling.master_times.phase('screening'):
+                child_list = self.get_child_list(list_repro, max_children)
 
             if child_list == None or len(child_list) == 0:
                 logger.info("mutation to reproduce env FAILED!!!")
@@ -315,7 +448,7 @@ class MultiESOptimizer:
                 if self.pass_mc(score_child):  # check mc
                     self.add_optimizer(env=new_env_config, cppn_params=new_cppn_params, seed=seed, created_at=iteration, model_params=np.array(theta_child))
                     admitted += 1
-                    if self.pass_mc(score_archive):
+                    if score_archive is not None and self.pass_mc(score_archive):
                         self.ANNECS += 1
                     if admitted >= max_admitted:
                         break
@@ -335,27 +468,84 @@ class MultiESOptimizer:
         for optim_id in list_delete:
             self.archive_optimizer(optim_id)           
 
+    def resume(self, path):
+        '''restore the state checkpointed in path, return the iteration to continue from'''
+        state = load_checkpoint(path)
+        self.ANNECS = state['ANNECS']
+        self.env_registry = state['env_registry']
+        self.env_archive = state['env_archive']
+        self.env_reproducer = state['env_reproducer']
+        self.optimizers = state['optimizers']
+        self.archived_optimizers = OrderedDict(state['archived_optimizers'])
+        self.score_matrix = state['score_matrix']
+        self.profile_logger = state.get('profile_logger')
+        # only the active optimizers and the profile log go on logging
+        for o in self.optimizers.values():
+            o.data_logger.resume()
+        if self.profile_logger is not None:
+            self.profile_logger.resume()
+        self.remove_stale_logs()
+        if self.args.profile and self.profile_logger is None:
+            self.profile_logger = self.make_profile_logger()
+
+        for o in self.optimizers.values():
+            o.attach(self.fiber_pool, self.store, self.score_matrix, self.eval_cache)
+        for o in self.archived_optimizers.values():
+            o.attach(self.fiber_pool, self.store, self.score_matrix, self.eval_cache,
+                     publish=False)
+        for o in list(self.optimizers.values()) + list(self.archived_optimizers.values()):
+            if o.pata_ec is not None:
+                self.novelty_index.add(o.optim_id, o.pata_ec)
+
+        np.random.set_state(state['np_random_state'])
+        random.setstate(state['random_state'])
+        return state['iteration']
+
     def optimize(self, iterations=200,
                  steps_before_transfer=25,
                  propose_with_adam=False,
                  checkpointing=False,
-                 reset_optimizer=True):
-
-        for iteration in range(iterations):
-
+                 reset_optimizer=True,
+                 start_iteration=0):
+
+        for iteration in range(start_iteration, iterations):
+            with profiling.master_times.phase('iteration'):
+                self.run_iteration(iteration, steps_before_transfer, propose_with_adam,
+                                   checkpointing, reset_optimizer)
+
+            if profiling.enabled:
+                self.profile_logger.log(**profiling.pop_profile_row(iteration))
+
+            # after the iteration's log rows, so that resuming from the
+            # checkpoint does not lose them; its time goes to the next row
+            if self.args.checkpoint_interval > 0 and (iteration + 1) % self.args.checkpoint_interval == 0:
+                with profiling.master_times.phase('checkpoint'):
+                    save_checkpoint(self, iteration + 1, self.checkpoint_dir)
+
+    def run_iteration(self, iteration, steps_before_transfer, propose_with_adam,
+                      checkpointing, reset_optimizer):
+        # nothing is in flight between iterations; the thetas of the niches
+        # are sent again, everything else published so far can go
+        self.store.keep_thetas(
+            [o.theta for o in self.optimizers.values()] +
+            [o.theta for o in self.archived_optimizers.values()])
+
+        with profiling.master_times.phase('adjust'):
             self.adjust_envs_niches(iteration, self.args.adjust_interval * steps_before_transfer,
                                     max_num_envs=self.args.max_num_envs)
 
-            for o in self.optimizers.values():
-                o.clean_dicts_before_iter()
+        for o in self.optimizers.values():
+            o.clean_dicts_before_iter()
 
+        with profiling.master_times.phase('es_step'):
             self.ind_es_step(iteration=iteration)
 
-            if len(self.optimizers) > 1 and iteration % steps_before_transfer == 0:
+        if len(self.optimizers) > 1 and iteration % steps_before_transfer == 0:
+            with profiling.master_times.phase('transfer'):
                 self.transfer(propose_with_adam=propose_with_adam,
                               checkpointing=checkpointing,
                               reset_optimizer=reset_optimizer)
 
-            if iteration % steps_before_transfer == 0:
-                for o in self.optimizers.values():
-                    o.save_to_logger(iteration)
+        if iteration % steps_before_transfer == 0:
+            for o in self.optimizers.values():
+                o.save_to_logger(iteration)
@@ -0,0 +1,50 @@
+# Copyright (c) 2020 Uber Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import numpy as np
+
+
+def policy_dtype(dim, niche_len):
+    '''
+        a best-policy snapshot, one record of a small header and the float32
+        theta; the niche field is as wide as the niche's name
+    '''
+    return np.dtype([
+        ('score', np.float64),
+        ('iteration', np.int64),
+        ('niche', 'U{}'.format(max(niche_len, 1))),
+        ('theta', np.float32, (dim,)),
+    ])
+
+
+def write_policy(path, theta, score, iteration, niche):
+    '''save a policy snapshot to path as a .npy file, atomically'''
+    record = np.zeros((), dtype=policy_dtype(len(theta), len(niche)))
+    record['score'] = score
+    record['iteration'] = -1 if iteration is None else iteration
+    record['niche'] = niche
+    record['theta'] = theta
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.save(f, record)
+    os.replace(tmp_path, path)
+
+
+def read_policy(path):
+    '''(theta, score, iteration, niche) of a snapshot written by write_policy'''
+    record = np.load(path)
+    return (record['theta'].astype(np.float64), float(record['score']),
+            int(record['iteration']), str(record['niche']))
@@ -0,0 +1,124 @@
+# Copyright (c) 2020 Uber Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+from collections import defaultdict
+
+# set by initialize_master_fiber / initialize_worker_fiber; when off a
+# phase costs one call returning a shared null context
+enabled = False
+
+WORKER_PHASES = ['reset', 'world_step', 'lidar', 'get_action', 'set_model_params', 'noise']
+MASTER_PHASES = ['iteration', 'adjust', 'pata_ec', 'screening', 'es_step', 'transfer',
+                 'submit', 'wait', 'grads', 'checkpoint']
+
+
+class _NoPhase:
+    '''does nothing, stands in for a _Phase when profiling is off'''
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_PHASE = _NoPhase()
+
+
+class PhaseTimes:
+    ''' seconds spent in each named phase, summed over every time it ran '''
+    def __init__(self):
+        self.seconds = defaultdict(float)
+
+    def phase(self, name):
+        '''context timing its body as `name`, when profiling is enabled'''
+        if not enabled:
+            return NO_PHASE
+        return _Phase(self, name)
+
+    def merge(self, seconds):
+        for name, s in seconds.items():
+            self.seconds[name] += s
+
+    def pop(self):
+        '''the times so far, starting over from zero'''
+        seconds = dict(self.seconds)
+        self.seconds.clear()
+        return seconds
+
+
+class _Phase:
+    __slots__ = ('times', 'name', 't_start')
+
+    def __init__(self, times, name):
+        self.times = times
+        self.name = name
+
+    def __enter__(self):
+        self.t_start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.times.seconds[self.name] += time.perf_counter() - self.t_start
+
+
+# on a worker, the phases of the task being run
+task_times = PhaseTimes()
+# on the master, its own phases and those reported back by workers. Phases
+# nest, e.g. transfer includes the submit and wait time of its evals, and
+# worker phases are summed over all workers.
+master_times = PhaseTimes()
+worker_times = PhaseTimes()
+
+
+def pop_task_times():
+    '''phase times of the finished task, to send back with its result'''
+    return task_times.pop() if enabled else None
+
+
+def merge_times(all_seconds):
+    '''sum of the phase times of several tasks, None if not profiled'''
+    all_seconds = [seconds for seconds in all_seconds if seconds is not None]
+    if not all_seconds:
+        return None
+    times = PhaseTimes()
+    for seconds in all_seconds:
+        times.merge(seconds)
+    return dict(times.seconds)
+
+
+def add_worker_times(results):
+    '''count the phase times that came back with task results'''
+    if enabled:
+        for result in results:
+            seconds = getattr(result, 'times', None)
+            if seconds is not None:
+                worker_times.merge(seconds)
+
+
+def profile_columns():
+    return (['iteration'] +
+            ['master_{}'.format(name) for name in MASTER_PHASES] +
+            ['worker_{}'.format(name) for name in WORKER_PHASES])
+
+
+def pop_profile_row(iteration):
+    '''log columns with the phase times since the last row'''
+    row = {'iteration': iteration}
+    master, worker = master_times.pop(), worker_times.pop()
+    row.update(('master_{}'.format(name), master.get(name, 0.0)) for name in MASTER_PHASES)
+    row.update(('worker_{}'.format(name), worker.get(name, 0.0)) for name in WORKER_PHASES)
+    return row
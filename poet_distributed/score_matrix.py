@@ -0,0 +1,58 @@
+# Copyright (c) 2020 Uber Technologies, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from collections import OrderedDict
+from .broadcast import theta_key
+import logging
+logger = logging.getLogger(__name__)
+
+
+class ScoreMatrix:
+    '''
+        Eval scores of thetas in niches, keyed by (theta digest, niche version).
+        Archived thetas never change and active ones change once per
+        iteration, so most cells survive from one adjust round to the next.
+    '''
+    def __init__(self):
+        self.scores = {}
+
+    def fill(self, thetas, targets):
+        '''eval every missing (theta, target) cell, all in one wave'''
+        self.fill_cells([(theta, target) for target in targets for theta in thetas])
+
+    def fill_cells(self, cells):
+        '''eval every missing one of the (theta, target) cells, all in one wave'''
+        pending = OrderedDict()
+        for theta, target in cells:
+            cell = (theta_key(theta), target.niche_key)
+            if cell not in self.scores and cell not in pending:
+                pending[cell] = (target, target.start_theta_eval(theta))
+
+        logger.debug('Score matrix evaluating {} new cells'.format(len(pending)))
+        for cell, (target, task) in pending.items():
+            self.scores[cell] = target.get_theta_eval(task).eval_returns_mean
+
+    def get(self, theta, target):
+        cell = (theta_key(theta), target.niche_key)
+        if cell not in self.scores:
+            self.fill([theta], [target])
+        return self.scores[cell]
+
+    def prune(self, thetas, targets):
+        '''drop cells of thetas and niches that are no longer around'''
+        keys = set(theta_key(theta) for theta in thetas)
+        niche_keys = set(target.niche_key for target in targets)
+        self.scores = {cell: score for cell, score in self.scores.items()
+                       if cell[0] in keys and cell[1] in niche_keys}
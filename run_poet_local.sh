@@ -31,5 +31,6 @@ python -u master.py \
   --adjust_interval=6 \
   --propose_with_adam \
   --steps_before_transfer=25 \
+  --executor=fork \
   --num_workers 10 \
   --n_iterations=60000 2>&1 | tee ~/ipp/$experiment/run.log
@@ -32,4 +32,5 @@ fiber run -v nfs bash -c "
   --propose_with_adam \
   --steps_before_transfer=25 \
   --num_workers 10 \
+  --broadcast_dir=/persistent/broadcast/$experiment \
   --n_iterations=60000 2>&1 | tee /persistent/ipp/$experiment/run.log"